@@ -1,14 +1,33 @@
 # Sistema_Pedidosv12.py
 import os
-import shutil
+import json
+import base64
+import cProfile
+import csv
+import gzip
+import io
+import hashlib
+import pickle
+import pstats
+import re
+import select
+import tempfile
+import threading
+import time
 import logging
+import multiprocessing
 import traceback
+import zipfile
 from decimal import Decimal, InvalidOperation
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from functools import wraps
 from pathlib import Path
 from urllib.parse import urlparse, ParseResult, urlunparse, quote_plus
 
+import click
 from flask import (
     Flask,
     abort,
@@ -19,13 +38,21 @@ from flask import (
     request,
     send_file,
     session,
+    stream_with_context,
+    g,
+    has_request_context,
     url_for,
 )
+from flask.cli import AppGroup
 from werkzeug.security import generate_password_hash, check_password_hash
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
+from xml.sax.saxutils import escape as xml_escape
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func, text
+from sqlalchemy import and_, bindparam, event, insert, inspect, or_, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import selectinload
 
 # =====================================================
@@ -131,6 +158,92 @@ if not MODELO_PATH.exists():
 LC_WORKBOOK_FILENAME = os.environ.get("PEDIDOS_LC_FILENAME") or "LC.xlsx"
 LC_WORKBOOK_OVERRIDE = os.environ.get("PEDIDOS_LC_PATH")
 
+# Threads da fila de jobs em segundo plano; 0 executa os jobs na propria requisicao
+JOB_WORKERS = int(os.environ.get("PEDIDOS_JOB_WORKERS") or 2)
+# Jobs "executando" ha mais que isso (worker morto) voltam para a fila no start
+JOB_STALE_AFTER = timedelta(minutes=int(os.environ.get("PEDIDOS_JOB_STALE_MINUTES") or 10))
+
+# Processos usados na geracao em lote (aprovacao em massa); 0 gera em sequencia.
+# Cada worker do gunicorn tem o seu pool: o padrao usa as CPUs disponiveis para
+# este processo (afinidade/limite do container, nao as do host), no maximo 4.
+GERACAO_PROCESSOS_MAX_PADRAO = 4
+
+
+def _default_generation_processes() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    # limite de CPU do container (cgroup v2, "quota periodo" ou "max periodo")
+    try:
+        quota, periodo = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, -(-int(quota) // int(periodo)))
+    except (OSError, ValueError):
+        pass
+    return max(1, min(cpus, GERACAO_PROCESSOS_MAX_PADRAO))
+
+
+GERACAO_PROCESSOS = int(os.environ.get("PEDIDOS_GERACAO_PROCESSOS") or _default_generation_processes())
+APROVACAO_LOTE_MAX = 200
+# Tempo maximo que a aprovacao em lote espera pelas planilhas dos processos
+GERACAO_TIMEOUT = float(os.environ.get("PEDIDOS_GERACAO_TIMEOUT_SECONDS") or 120)
+
+# Retencao: idade maxima dos pedidos, tamanho dos lotes de exclusao, intervalo
+# do agendamento automatico (0 desliga) e arquivamento opcional em JSONL.gz
+RETENCAO_DIAS = int(os.environ.get("PEDIDOS_RETENCAO_DIAS") or 135)
+RETENCAO_LOTE = int(os.environ.get("PEDIDOS_RETENCAO_LOTE") or 500)
+RETENCAO_INTERVALO_HORAS = float(os.environ.get("PEDIDOS_RETENCAO_INTERVALO_HORAS") or 24)
+RETENCAO_ARQUIVAR = (os.environ.get("PEDIDOS_RETENCAO_ARQUIVAR") or "").strip().lower() in {"1", "true", "yes", "on"}
+PASTA_ARQUIVO_MORTO = Path(
+    os.environ.get("PEDIDOS_ARQUIVO_MORTO_DIR") or (STORAGE_ROOT / "arquivo_morto")
+)
+
+# Cache em memoria de fornecedores/usuarios: validade maxima e intervalo entre
+# consultas ao carimbo de versao no banco (consistencia entre workers)
+CACHE_TTL = float(os.environ.get("PEDIDOS_CACHE_TTL") or 300)
+CACHE_VERSION_CHECK = float(os.environ.get("PEDIDOS_CACHE_CHECK_SECONDS") or 2)
+
+# Sincronizacao incremental (?since=): por quanto tempo os ids removidos ficam
+# registrados e a folga aplicada ao `since` para cobrir transacoes em andamento
+SYNC_HORIZONTE_DIAS = int(os.environ.get("PEDIDOS_SYNC_HORIZONTE_DIAS") or 7)
+SYNC_SOBREPOSICAO = timedelta(seconds=5)
+
+# Eventos (SSE): intervalo de consulta a tabela de eventos quando nao ha
+# LISTEN/NOTIFY (SQLite), duracao maxima de cada conexao (o navegador reconecta
+# sozinho e continua do ultimo id) e por quanto tempo os eventos ficam no banco
+EVENTOS_POLL = float(os.environ.get("PEDIDOS_EVENTOS_POLL_SECONDS") or 1)
+EVENTOS_CONEXAO_MAX = float(os.environ.get("PEDIDOS_EVENTOS_CONEXAO_SECONDS") or 120)
+EVENTOS_HEARTBEAT = 15
+# Conexoes SSE simultaneas por worker: cada uma ocupa uma thread do gthread
+# enquanto aberta; acima do limite /api/eventos responde 503 e o navegador
+# sincroniza por consulta periodica (?since=). 0 desliga o SSE.
+EVENTOS_CONEXOES_MAX = int(os.environ.get("PEDIDOS_EVENTOS_CONEXOES_MAX") or 2)
+# Ids pulados (transacao com id menor que ainda nao fez commit) sao reconsultados
+# por este tempo antes de serem dados como descartados (rollback)
+EVENTOS_LACUNA_SEGUNDOS = 30
+EVENTOS_LACUNAS_MAX = 500
+EVENTOS_RETENCAO = timedelta(days=1)
+EVENTOS_CANAL = "pedidos_eventos"
+
+# Profiling sob demanda (admins): onde os .prof sao gravados e quantos manter
+PASTA_PROFILES = Path(os.environ.get("PEDIDOS_PROFILES_DIR") or (STORAGE_ROOT / "profiles"))
+PROFILES_MAX = int(os.environ.get("PEDIDOS_PROFILES_MAX") or 50)
+
+# /metrics: token opcional (Authorization: Bearer <token>) exigido do coletor
+METRICS_TOKEN = (os.environ.get("PEDIDOS_METRICS_TOKEN") or "").strip()
+
+# Diagnostico de SQL (opt-in): comandos acima de PEDIDOS_SQL_LENTO_MS, requisicoes
+# com mais de PEDIDOS_SQL_ORCAMENTO comandos ou com o mesmo comando repetido
+# PEDIDOS_SQL_REPETICOES vezes (indicio de N+1) sao registrados em JSON
+SQL_DIAGNOSTICO = (os.environ.get("PEDIDOS_SQL_DIAGNOSTICO") or "").strip().lower() in {"1", "true", "yes", "on"}
+SQL_LENTO_MS = float(os.environ.get("PEDIDOS_SQL_LENTO_MS") or 100)
+SQL_ORCAMENTO = int(os.environ.get("PEDIDOS_SQL_ORCAMENTO") or 30)
+SQL_REPETICOES = int(os.environ.get("PEDIDOS_SQL_REPETICOES") or 5)
+
+# Motor de geracao das planilhas: "openpyxl" (padrao) ou "xml" (edicao direta do zip)
+PLANILHA_ENGINE = (os.environ.get("PEDIDOS_PLANILHA_ENGINE") or "openpyxl").strip().lower()
+
 PASTA_PEDIDOS_GERADOS = Path(
     os.environ.get("PEDIDOS_GERADOS_DIR") or (STORAGE_ROOT / "Pedidos Gerados")
 )
@@ -183,6 +296,7 @@ db = SQLAlchemy(app)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("pedidos_app")
+sql_logger = logging.getLogger("pedidos_app.sql")
 
 
 # =====================================================
@@ -192,6 +306,8 @@ class User(db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False, index=True)
+    # username normalizado (maiusculo) para buscas por igualdade com indice
+    username_norm = db.Column(db.String(150), nullable=True, index=True)
     password = db.Column(db.String(300), nullable=False)
     role = db.Column(db.String(50), nullable=False, default="creator")
 
@@ -200,15 +316,35 @@ class Fornecedor(db.Model):
     __tablename__ = "fornecedores"
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(255), unique=True, nullable=False)
+    # nome normalizado (maiusculo, sem espacos nas pontas) para buscas com indice
+    nome_norm = db.Column(db.String(255), nullable=True, index=True)
 
 
 class Pedido(db.Model):
     __tablename__ = "pedidos"
+    __table_args__ = (
+        db.Index("ix_pedidos_status_created_at", "status", "created_at"),
+        db.Index("ix_pedidos_created_by_created_at", "created_by", "created_at"),
+        db.Index("ix_pedidos_updated_at", "updated_at"),
+        # ordem da listagem paginada (keyset) e dos lotes da retencao
+        db.Index("ix_pedidos_created_at_id", "created_at", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     fornecedor = db.Column(db.String(255), nullable=False)
+    # fornecedor normalizado (maiusculo, sem espacos nas pontas) para a busca por trecho no SQLite
+    fornecedor_busca = db.Column(db.String(255), nullable=True)
+    # impressao digital (payload + versao do modelo) do arquivo_excel atual
+    arquivo_fingerprint = db.Column(db.String(64), nullable=True)
+    # agregados dos itens, mantidos a cada escrita (resumo sem varrer pedidos_items)
+    total_valor = db.Column(db.Numeric(14, 2), nullable=True)
+    item_count = db.Column(db.Integer, nullable=True)
+    # valor do contador global de pedidos na ultima alteracao (ETag)
+    versao = db.Column(db.Integer, nullable=True)
     arquivo_excel = db.Column(db.String(500), nullable=True)
     arquivo_pdf = db.Column(db.String(500), nullable=True)
     created_at = db.Column(db.DateTime(timezone=False), default=datetime.utcnow, nullable=False)
+    # ultima alteracao de status/itens/arquivo (sincronizacao incremental)
+    updated_at = db.Column(db.DateTime(timezone=False), nullable=True)
     status = db.Column(db.String(50), default="Pendente", nullable=False)
     created_by = db.Column(db.String(150), nullable=True)
 
@@ -216,7 +352,8 @@ class Pedido(db.Model):
         "PedidoItem",
         backref="pedido",
         cascade="all, delete-orphan",
-        lazy="selectin",
+        # itens sao carregados explicitamente (selectinload) onde sao usados
+        lazy="select",
     )
 
 
@@ -237,6 +374,82 @@ class PedidoItem(db.Model):
     estoque = db.Column(db.Integer, nullable=True)
 
 
+class ImportacaoLC(db.Model):
+    """Estado da ultima importacao de uma planilha LC (deteccao de mudancas)."""
+
+    __tablename__ = "lc_importacoes"
+    id = db.Column(db.Integer, primary_key=True)
+    caminho = db.Column(db.String(1000), unique=True, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    tamanho = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    importado_em = db.Column(db.DateTime(timezone=False), default=datetime.utcnow, nullable=False)
+
+
+class ImportacaoLCLinha(db.Model):
+    """Impressao digital de cada linha ja importada, por planilha LC."""
+
+    __tablename__ = "lc_importacao_linhas"
+    importacao_id = db.Column(db.Integer, db.ForeignKey("lc_importacoes.id"), primary_key=True)
+    linha = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    pedido_id = db.Column(db.Integer, nullable=True)
+
+
+class CacheVersao(db.Model):
+    """Carimbo de versao por conjunto cacheado; incrementado a cada escrita."""
+
+    __tablename__ = "cache_versoes"
+    nome = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    """Trabalho em segundo plano persistido (sobrevive a reinicios do worker)."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (db.Index("ix_jobs_status_created_at", "status", "created_at"),)
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    pedido_id = db.Column(db.Integer, nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default="pendente")
+    resultado = db.Column(db.String(500), nullable=True)
+    erro = db.Column(db.Text, nullable=True)
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    created_by = db.Column(db.String(150), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=False), default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime(timezone=False), nullable=True)
+    finished_at = db.Column(db.DateTime(timezone=False), nullable=True)
+
+
+class Agendamento(db.Model):
+    """Ultima execucao de uma tarefa periodica; reivindicada por UPDATE condicional."""
+
+    __tablename__ = "agendamentos"
+    nome = db.Column(db.String(50), primary_key=True)
+    executado_em = db.Column(db.DateTime(timezone=False), nullable=False)
+
+
+class PedidoRemovido(db.Model):
+    """Ids de pedidos excluidos, para que a sincronizacao incremental os retire."""
+
+    __tablename__ = "pedidos_removidos"
+    id = db.Column(db.Integer, primary_key=True)
+    pedido_id = db.Column(db.Integer, nullable=False)
+    removido_em = db.Column(db.DateTime(timezone=False), nullable=False, index=True)
+
+
+class Evento(db.Model):
+    """Alteracoes de pedidos publicadas em /api/eventos (compartilhadas entre workers)."""
+
+    __tablename__ = "eventos"
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(30), nullable=False)
+    pedido_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(50), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=False), default=datetime.utcnow, nullable=False, index=True)
+
+
 # =====================================================
 # UTILITARIOS / AUTH
 # =====================================================
@@ -289,12 +502,364 @@ def _is_password_hashed(value: str | None) -> bool:
     return value.startswith(known_prefixes)
 
 
+def normalize_search_text(value: str | None) -> str:
+    return (value or "").strip().upper()
+
+
+def like_substring(value: str) -> str:
+    """Padrao LIKE "contem `value`", com % e _ tratados como texto (escape "\\")."""
+    escapado = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escapado}%"
+
+
+def _is_postgres() -> bool:
+    return db.engine.dialect.name == "postgresql"
+
+
 def _serialize_user(user: User | None) -> dict | None:
     if not user:
         return None
     return {"id": user.id, "username": user.username, "role": user.role}
 
 
+# =====================================================
+# METRICAS (formato texto do Prometheus em /metrics)
+# =====================================================
+# Contadores e histogramas ficam em memoria, por processo: cada worker do
+# gunicorn expoe os proprios numeros (o coletor soma por instancia).
+LATENCIA_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SQL_POR_REQUISICAO_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_METRICAS = {
+    "pedidos_http_requests_total": ("counter", "Requisicoes atendidas por endpoint, metodo e status"),
+    "pedidos_http_request_duration_seconds": ("histogram", "Latencia das requisicoes por endpoint"),
+    "pedidos_http_request_sql_statements": ("histogram", "Comandos SQL executados por requisicao"),
+    "pedidos_http_request_sql_seconds_total": ("counter", "Tempo gasto em SQL pelas requisicoes de cada endpoint"),
+    "pedidos_sql_statements_total": ("counter", "Comandos SQL executados, por operacao"),
+    "pedidos_sql_duration_seconds": ("histogram", "Duracao dos comandos SQL, por operacao"),
+    "pedidos_planilha_geracao_seconds": ("histogram", "Geracao de uma planilha de pedido"),
+    "pedidos_planilha_lote_seconds": ("histogram", "Geracao de planilhas em lote (aprovacao em massa)"),
+    "pedidos_planilha_cache_total": ("counter", "Reaproveitamento de planilhas ja geradas"),
+    "pedidos_lc_importacao_seconds": ("histogram", "Importacao da planilha LC"),
+    "pedidos_lc_importacao_pedidos_total": ("counter", "Pedidos criados pela importacao da planilha LC"),
+    "pedidos_eventos_recusados_total": ("counter", "Conexoes SSE recusadas (limite por worker atingido)"),
+}
+
+_metricas_lock = threading.Lock()
+_contadores: dict[tuple, float] = {}
+_histogramas: dict[tuple, dict] = {}
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((chave, str(valor)) for chave, valor in labels.items()))
+
+
+def incrementar_metrica(nome: str, valor: float = 1, **labels) -> None:
+    chave = (nome, _labels_key(labels))
+    with _metricas_lock:
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+
+def observar_metrica(nome: str, valor: float, buckets=LATENCIA_BUCKETS, **labels) -> None:
+    chave = (nome, _labels_key(labels))
+    with _metricas_lock:
+        hist = _histogramas.get(chave)
+        if hist is None:
+            hist = _histogramas[chave] = {"buckets": buckets, "contagens": [0] * len(buckets), "soma": 0.0, "total": 0}
+        for idx, limite in enumerate(hist["buckets"]):
+            if valor <= limite:
+                hist["contagens"][idx] += 1
+        hist["soma"] += valor
+        hist["total"] += 1
+
+
+def medir_duracao(nome: str):
+    """Decorator: registra a duracao de cada chamada no histograma `nome`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observar_metrica(nome, time.perf_counter() - inicio)
+
+        return wrapper
+
+    return decorator
+
+
+def _formatar_labels(labels: tuple, extra: tuple = ()) -> str:
+    pares = list(labels) + list(extra)
+    if not pares:
+        return ""
+    escapados = (
+        chave + '="' + valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for chave, valor in pares
+    )
+    return "{" + ",".join(escapados) + "}"
+
+
+def render_metrics() -> str:
+    with _metricas_lock:
+        contadores = dict(_contadores)
+        histogramas = {chave: dict(hist, contagens=list(hist["contagens"])) for chave, hist in _histogramas.items()}
+    linhas = []
+    for nome, (tipo, descricao) in _METRICAS.items():
+        linhas.append(f"# HELP {nome} {descricao}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+        if tipo == "counter":
+            for (metrica, labels), valor in sorted(contadores.items()):
+                if metrica == nome:
+                    linhas.append(f"{nome}{_formatar_labels(labels)} {valor:g}")
+            continue
+        for (metrica, labels), hist in sorted(histogramas.items()):
+            if metrica != nome:
+                continue
+            for limite, quantidade in zip(hist["buckets"], hist["contagens"]):
+                linhas.append(f"{nome}_bucket{_formatar_labels(labels, (('le', f'{limite:g}'),))} {quantidade}")
+            linhas.append(f"{nome}_bucket{_formatar_labels(labels, (('le', '+Inf'),))} {hist['total']}")
+            linhas.append(f"{nome}_sum{_formatar_labels(labels)} {hist['soma']:.6f}")
+            linhas.append(f"{nome}_count{_formatar_labels(labels)} {hist['total']}")
+    return "\n".join(linhas) + "\n"
+
+
+# placeholders de listas expandidas (IN (?, ?, ?)) viram um so, agrupando a forma
+_SQL_LISTA_PARAMETROS = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|%s)\s*,)+\s*(?:\?|%\(\w+\)s|%s)\s*\)")
+
+
+def _sql_forma(statement: str) -> str:
+    return " ".join(_SQL_LISTA_PARAMETROS.sub("(?)", statement).split())
+
+
+def _log_sql_diagnostico(evento: str, **dados) -> None:
+    if has_request_context():
+        dados.setdefault("endpoint", request.endpoint)
+        dados.setdefault("metodo", request.method)
+        dados.setdefault("caminho", request.path)
+    sql_logger.warning(json.dumps({"evento": evento, **dados}, default=str, ensure_ascii=False))
+
+
+def _diagnosticar_sql(statement: str, parameters, duracao: float) -> None:
+    if duracao * 1000 >= SQL_LENTO_MS:
+        _log_sql_diagnostico(
+            "sql_lento",
+            ms=round(duracao * 1000, 2),
+            sql=statement,
+            parametros=repr(parameters)[:1000],
+        )
+    if has_request_context() and "sql_formas" in g:
+        forma = _sql_forma(statement)
+        g.sql_formas[forma] = g.sql_formas.get(forma, 0) + 1
+
+
+def _diagnosticar_requisicao() -> None:
+    if g.sql_comandos > SQL_ORCAMENTO:
+        _log_sql_diagnostico(
+            "sql_orcamento_excedido",
+            comandos=g.sql_comandos,
+            orcamento=SQL_ORCAMENTO,
+            ms=round(g.sql_tempo * 1000, 2),
+        )
+    for forma, vezes in g.sql_formas.items():
+        if vezes >= SQL_REPETICOES:
+            _log_sql_diagnostico("sql_repetido", vezes=vezes, sql=forma)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _sql_antes(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_sql_inicio", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _sql_depois(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("_sql_inicio")
+    if not inicios:
+        return
+    duracao = time.perf_counter() - inicios.pop()
+    operacao = (statement.lstrip().split(None, 1) or ["?"])[0].upper()
+    incrementar_metrica("pedidos_sql_statements_total", operacao=operacao)
+    observar_metrica("pedidos_sql_duration_seconds", duracao, operacao=operacao)
+    if has_request_context() and "metricas_inicio" in g:
+        g.sql_comandos += 1
+        g.sql_tempo += duracao
+    if SQL_DIAGNOSTICO:
+        _diagnosticar_sql(statement, parameters, duracao)
+
+
+@app.before_request
+def _metricas_inicio_requisicao():
+    g.metricas_inicio = time.perf_counter()
+    g.sql_comandos = 0
+    g.sql_tempo = 0.0
+    if SQL_DIAGNOSTICO:
+        g.sql_formas = {}
+
+
+@app.after_request
+def _metricas_fim_requisicao(response):
+    if "metricas_inicio" not in g:
+        return response
+    endpoint = request.endpoint or "desconhecido"
+    incrementar_metrica(
+        "pedidos_http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    observar_metrica(
+        "pedidos_http_request_duration_seconds", time.perf_counter() - g.metricas_inicio, endpoint=endpoint
+    )
+    observar_metrica(
+        "pedidos_http_request_sql_statements", g.sql_comandos, buckets=SQL_POR_REQUISICAO_BUCKETS, endpoint=endpoint
+    )
+    incrementar_metrica("pedidos_http_request_sql_seconds_total", g.sql_tempo, endpoint=endpoint)
+    if SQL_DIAGNOSTICO and "sql_formas" in g:
+        _diagnosticar_requisicao()
+    return response
+
+
+# =====================================================
+# PROFILING SOB DEMANDA (admins)
+# =====================================================
+# Um admin pede o profile de uma requisicao com o cabecalho X-Pedidos-Profile: 1
+# (ou ?_profile=1); a requisicao roda sob cProfile e o resultado vai para
+# PASTA_PROFILES, com o nome devolvido no mesmo cabecalho da resposta.
+PROFILE_HEADER = "X-Pedidos-Profile"
+_PROFILE_NOME = re.compile(r"^[\w.-]+\.prof$")
+
+
+def _profiling_solicitado() -> bool:
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get("_profile") or ""
+    if flag.strip().lower() not in {"1", "true", "yes", "on"}:
+        return False
+    user = current_user()
+    return bool(user and user.get("role") == "admin")
+
+
+def _limitar_profiles() -> None:
+    # nomes comecam pelo horario: ordem alfabetica = ordem cronologica
+    for antigo in sorted(PASTA_PROFILES.glob("*.prof"))[:-PROFILES_MAX]:
+        antigo.unlink(missing_ok=True)
+
+
+def _salvar_profile(profiler: cProfile.Profile) -> str:
+    PASTA_PROFILES.mkdir(parents=True, exist_ok=True)
+    endpoint = re.sub(r"[^\w-]", "_", request.endpoint or "desconhecido")
+    nome = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}_{endpoint}.prof"
+    profiler.dump_stats(str(PASTA_PROFILES / nome))
+    _limitar_profiles()
+    return nome
+
+
+def list_profiles() -> list[dict]:
+    if not PASTA_PROFILES.exists():
+        return []
+    perfis = []
+    for arquivo in sorted(PASTA_PROFILES.glob("*.prof"), reverse=True):
+        stat = arquivo.stat()
+        perfis.append(
+            {
+                "nome": arquivo.name,
+                "tamanho": stat.st_size,
+                "criado_em": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+            }
+        )
+    return perfis
+
+
+def resolve_profile_path(nome: str) -> Path | None:
+    if not _PROFILE_NOME.match(nome or ""):
+        return None
+    caminho = PASTA_PROFILES / nome
+    return caminho if caminho.is_file() else None
+
+
+def profile_summary(caminho: Path, limite: int = 60) -> str:
+    saida = io.StringIO()
+    stats = pstats.Stats(str(caminho), stream=saida)
+    stats.sort_stats("cumulative").print_stats(limite)
+    return saida.getvalue()
+
+
+@app.before_request
+def _profiling_inicio():
+    if not _profiling_solicitado():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # outro profile ativo no processo (Python 3.12+ permite um por vez)
+        logger.warning("Profile ignorado: outro profile em andamento")
+        return
+    g.profiler = profiler
+
+
+@app.after_request
+def _profiling_fim(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    try:
+        response.headers[PROFILE_HEADER] = _salvar_profile(profiler)
+    except OSError:
+        logger.exception("Falha ao gravar profile")
+    return response
+
+
+# =====================================================
+# CACHE EM MEMORIA (fornecedores / usuarios)
+# =====================================================
+CACHE_FORNECEDORES = "fornecedores"
+CACHE_USUARIOS = "usuarios"
+# contador global das alteracoes em pedidos (ETag da listagem e dos detalhes)
+CACHE_PEDIDOS = "pedidos"
+CACHE_NOMES = (CACHE_FORNECEDORES, CACHE_USUARIOS, CACHE_PEDIDOS)
+
+_read_cache: dict[str, dict] = {}
+_read_cache_lock = threading.Lock()
+
+
+def _current_cache_version(nome: str) -> int:
+    versao = db.session.query(CacheVersao.versao).filter(CacheVersao.nome == nome).scalar()
+    return versao or 0
+
+
+def bump_cache_version(nome: str) -> None:
+    """Incrementa o carimbo na transacao corrente; o chamador faz o commit."""
+    db.session.query(CacheVersao).filter(CacheVersao.nome == nome).update(
+        {CacheVersao.versao: CacheVersao.versao + 1}, synchronize_session=False
+    )
+
+
+def invalidate_cache(nome: str) -> None:
+    with _read_cache_lock:
+        _read_cache.pop(nome, None)
+
+
+def cached_read(nome: str, loader):
+    agora = time.monotonic()
+    with _read_cache_lock:
+        entry = _read_cache.get(nome)
+    if entry and agora - entry["loaded_at"] < CACHE_TTL:
+        if agora - entry["checked_at"] < CACHE_VERSION_CHECK:
+            return entry["value"]
+        if _current_cache_version(nome) == entry["version"]:
+            entry["checked_at"] = agora
+            return entry["value"]
+
+    versao = _current_cache_version(nome)
+    value = loader()
+    with _read_cache_lock:
+        _read_cache[nome] = {
+            "value": value,
+            "version": versao,
+            "loaded_at": agora,
+            "checked_at": agora,
+        }
+    return value
+
+
 # =====================================================
 # USUARIOS
 # =====================================================
@@ -306,12 +871,11 @@ def garantir_usuarios_iniciais():
         ("LUCAS", "1234", "admin"),
     ]
     for username, password, role in defaults:
-        user = User.query.filter(func.upper(User.username) == username).first()
-        hashed = generate_password_hash(password)
+        user = User.query.filter(User.username_norm == username).first()
         if user:
             needs_update = False
             if not _is_password_hashed(user.password):
-                user.password = hashed
+                user.password = generate_password_hash(password)
                 needs_update = True
             if user.role != role:
                 user.role = role
@@ -319,12 +883,23 @@ def garantir_usuarios_iniciais():
             if needs_update:
                 db.session.add(user)
         else:
-            db.session.add(User(username=username, password=hashed, role=role))
+            db.session.add(
+                User(
+                    username=username,
+                    username_norm=username,
+                    password=generate_password_hash(password),
+                    role=role,
+                )
+            )
     try:
+        if db.session.new or db.session.dirty:
+            db.session.flush()
+            bump_cache_version(CACHE_USUARIOS)
         db.session.commit()
     except Exception:
         db.session.rollback()
         logger.exception("Erro ao garantir usuarios iniciais")
+    invalidate_cache(CACHE_USUARIOS)
 
 
 def verificar_login(username: str, password: str) -> dict | None:
@@ -332,7 +907,7 @@ def verificar_login(username: str, password: str) -> dict | None:
     password = (password or "").strip()
     if not username or not password:
         return None
-    user = User.query.filter(func.upper(User.username) == username).first()
+    user = User.query.filter(User.username_norm == username).first()
     if not user:
         return None
     stored = user.password or ""
@@ -356,12 +931,14 @@ def change_password(username: str, new_password: str):
     username = (username or "").strip().upper()
     if not username:
         raise ValueError("Usuario nao encontrado")
-    user = User.query.filter(func.upper(User.username) == username).first()
+    user = User.query.filter(User.username_norm == username).first()
     if not user:
         raise ValueError("Usuario nao encontrado")
     user.password = generate_password_hash(new_password)
     db.session.add(user)
+    bump_cache_version(CACHE_USUARIOS)
     db.session.commit()
+    invalidate_cache(CACHE_USUARIOS)
 
 
 def create_user(username: str, password: str, role: str):
@@ -371,31 +948,40 @@ def create_user(username: str, password: str, role: str):
     if not username or not password:
         raise ValueError("Usuario e senha devem ser informados")
     hashed = generate_password_hash(password)
-    user = User(username=username, password=hashed, role=role)
+    user = User(username=username, username_norm=username, password=hashed, role=role)
     db.session.add(user)
     try:
+        db.session.flush()
+        bump_cache_version(CACHE_USUARIOS)
         db.session.commit()
     except IntegrityError as exc:
         db.session.rollback()
         raise ValueError("Usuario ja existe") from exc
+    invalidate_cache(CACHE_USUARIOS)
 
 
 def delete_user(username: str):
     username = (username or "").strip().upper()
     if not username:
         raise ValueError("Usuario nao encontrado")
-    user = User.query.filter(func.upper(User.username) == username).first()
+    user = User.query.filter(User.username_norm == username).first()
     if not user:
         raise ValueError("Usuario nao encontrado")
     db.session.delete(user)
+    bump_cache_version(CACHE_USUARIOS)
     db.session.commit()
+    invalidate_cache(CACHE_USUARIOS)
 
 
-def list_users() -> list[dict]:
+def _load_users() -> list[dict]:
     users = User.query.order_by(User.username).all()
     return [_serialize_user(user) for user in users if user]
 
 
+def list_users() -> list[dict]:
+    return list(cached_read(CACHE_USUARIOS, _load_users))
+
+
 # =====================================================
 # FORNECEDORES
 # =====================================================
@@ -403,106 +989,305 @@ def add_supplier(nome: str):
     nome = (nome or "").strip()
     if not nome:
         raise ValueError("Informe o nome do fornecedor")
-    fornecedor = Fornecedor(nome=nome)
+    fornecedor = Fornecedor(nome=nome, nome_norm=normalize_search_text(nome))
     db.session.add(fornecedor)
     try:
+        db.session.flush()
+        bump_cache_version(CACHE_FORNECEDORES)
         db.session.commit()
     except IntegrityError as exc:
         db.session.rollback()
         raise ValueError("Fornecedor ja existe") from exc
+    invalidate_cache(CACHE_FORNECEDORES)
     return nome
 
 
-def list_suppliers() -> list[str]:
+def _load_suppliers() -> list[str]:
     fornecedores = Fornecedor.query.order_by(Fornecedor.nome).all()
     return [f.nome for f in fornecedores]
 
 
+def list_suppliers() -> list[str]:
+    return list(cached_read(CACHE_FORNECEDORES, _load_suppliers))
+
+
 # =====================================================
 # PEDIDOS
 # =====================================================
-def purge_old_pedidos(days: int = 135) -> int:
+def _archive_orders(handle, pedido_ids: list[int]) -> None:
+    pedidos = (
+        Pedido.query.options(selectinload(Pedido.itens))
+        .filter(Pedido.id.in_(pedido_ids))
+        .all()
+    )
+    for pedido in pedidos:
+        registro = serialize_order(pedido)
+        registro.pop("arquivo_excel_path", None)
+        handle.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+
+
+def _remove_order_file(arquivo_excel: str | None) -> int:
+    """Apaga a planilha de um pedido removido; devolve os bytes liberados."""
+    if not arquivo_excel:
+        return 0
+    caminho = Path(arquivo_excel).name
+    for base_dir in (PASTA_PEDIDOS_APROVADOS, PASTA_PEDIDOS_GERADOS):
+        candidato = Path(base_dir) / caminho
+        try:
+            tamanho = candidato.stat().st_size
+            candidato.unlink()
+            return tamanho
+        except FileNotFoundError:
+            continue
+        except OSError:
+            logger.warning("Nao foi possivel remover %s", candidato)
+            return 0
+    return 0
+
+
+def _purge_orphan_items(batch_size: int) -> int:
+    # SQLite nao aplica a FK: itens de pedidos ja removidos ficam orfaos
+    removidos = 0
+    while True:
+        ids = [
+            item_id
+            for (item_id,) in db.session.query(PedidoItem.id)
+            .outerjoin(Pedido, Pedido.id == PedidoItem.pedido_id)
+            .filter(Pedido.id.is_(None))
+            .limit(batch_size)
+            .all()
+        ]
+        if not ids:
+            return removidos
+        db.session.query(PedidoItem).filter(PedidoItem.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        removidos += len(ids)
+
+
+def run_retention(
+    days: int = RETENCAO_DIAS,
+    batch_size: int = RETENCAO_LOTE,
+    archive: bool = RETENCAO_ARQUIVAR,
+) -> dict:
+    """Remove pedidos antigos em lotes (itens + pedidos + planilhas).
+
+    Cada lote e uma transacao curta, evitando locks longos nas tabelas.
+    Com `archive`, os pedidos sao gravados antes num JSONL compactado.
+    """
     cutoff = datetime.utcnow() - timedelta(days=days)
+    relatorio = {"pedidos": 0, "itens": 0, "arquivos": 0, "bytes": 0, "arquivo_morto": None}
+    handle = None
     try:
-        removed = (
-            db.session.query(Pedido)
-            .filter(Pedido.created_at < cutoff)
-            .delete(synchronize_session=False)
-        )
+        while True:
+            lote = (
+                db.session.query(Pedido.id, Pedido.arquivo_excel)
+                .filter(Pedido.created_at < cutoff)
+                # leitura em faixa do indice (created_at, id), sem ordenar a tabela
+                .order_by(Pedido.created_at, Pedido.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not lote:
+                break
+            ids = [row.id for row in lote]
+            if archive:
+                if handle is None:
+                    PASTA_ARQUIVO_MORTO.mkdir(parents=True, exist_ok=True)
+                    destino = PASTA_ARQUIVO_MORTO / f"pedidos_{datetime.utcnow():%Y%m%d%H%M%S}.jsonl.gz"
+                    handle = gzip.open(destino, "at", encoding="utf-8")
+                    relatorio["arquivo_morto"] = str(destino)
+                _archive_orders(handle, ids)
+                handle.flush()
+            relatorio["itens"] += (
+                db.session.query(PedidoItem)
+                .filter(PedidoItem.pedido_id.in_(ids))
+                .delete(synchronize_session=False)
+            )
+            relatorio["pedidos"] += (
+                db.session.query(Pedido)
+                .filter(Pedido.id.in_(ids))
+                .delete(synchronize_session=False)
+            )
+            db.session.execute(
+                insert(PedidoRemovido),
+                [{"pedido_id": pedido_id, "removido_em": datetime.utcnow()} for pedido_id in ids],
+            )
+            record_order_events(EVENTO_REMOVIDO, [(pedido_id, None) for pedido_id in ids])
+            touch_orders([])
+            db.session.commit()
+            # arquivos so saem depois do commit do lote
+            for row in lote:
+                liberados = _remove_order_file(row.arquivo_excel)
+                if liberados:
+                    relatorio["arquivos"] += 1
+                    relatorio["bytes"] += liberados
+
+        relatorio["itens"] += _purge_orphan_items(batch_size)
+        db.session.query(PedidoRemovido).filter(
+            PedidoRemovido.removido_em < datetime.utcnow() - timedelta(days=SYNC_HORIZONTE_DIAS)
+        ).delete(synchronize_session=False)
+        db.session.query(Evento).filter(
+            Evento.created_at < datetime.utcnow() - EVENTOS_RETENCAO
+        ).delete(synchronize_session=False)
         db.session.commit()
-        if removed:
-            logger.info("Removidos %s pedidos antigos", removed)
-        return removed
     except Exception:
         db.session.rollback()
         logger.exception("Erro ao remover pedidos antigos")
+        raise
+    finally:
+        if handle is not None:
+            handle.close()
+
+    if relatorio["pedidos"] or relatorio["itens"]:
+        logger.info(
+            "Retencao: %s pedidos, %s itens, %s arquivos (%s bytes) removidos",
+            relatorio["pedidos"],
+            relatorio["itens"],
+            relatorio["arquivos"],
+            relatorio["bytes"],
+        )
+    return relatorio
+
+
+def purge_old_pedidos(days: int = RETENCAO_DIAS) -> int:
+    try:
+        return run_retention(days=days)["pedidos"]
+    except Exception:
         return 0
 
 
+def _normalize_item(raw, idx):
+    """Valida uma linha de item; devolve None para linha vazia."""
+    if not isinstance(raw, dict):
+        raise ValueError(f"Item {idx} invalido")
+
+    quantidade_raw = raw.get("quantidade")
+    valor_raw = raw.get("valor")
+    codigo = str(raw.get("codigo", "")).strip()
+    descricao = str(raw.get("descricao", "")).strip()
+    prefixo = str(raw.get("prefixo", "")).strip()
+    estoque_raw = raw.get("estoque")
+
+    empty_line = (
+        (quantidade_raw in (None, "", 0, "0"))
+        and not codigo
+        and not descricao
+        and (valor_raw in (None, "", 0, "0", 0.0))
+        and not prefixo
+        and (estoque_raw in (None, "", 0, "0", 0.0))
+    )
+    if empty_line:
+        return None
+
+    try:
+        quantidade = int(quantidade_raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"Item {idx} invalido: quantidade")
+    if quantidade <= 0:
+        raise ValueError(f"Item {idx} precisa de quantidade maior que zero")
+
+    try:
+        valor = float(valor_raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"Item {idx} invalido: valor")
+
+    if not codigo or not descricao:
+        raise ValueError(f"Item {idx} precisa de codigo e descricao")
+
+    if estoque_raw in (None, "", 0, "0", 0.0):
+        estoque = None
+    else:
+        try:
+            estoque = int(estoque_raw)
+        except (TypeError, ValueError):
+            raise ValueError(f"Item {idx} invalido: estoque")
+
+    # id do item existente (edicao); ausente em itens novos
+    item_id = raw.get("id")
+    try:
+        item_id = int(item_id) if item_id not in (None, "") else None
+    except (TypeError, ValueError):
+        raise ValueError(f"Item {idx} invalido: id")
+
+    return {
+        "id": item_id,
+        "quantidade": quantidade,
+        "codigo": codigo,
+        "descricao": descricao,
+        "prefixo": prefixo,
+        "valor": valor,
+        "estoque": estoque,
+    }
+
+
 def normalize_items(items):
     # exige pelo menos 1 item valido
     if not isinstance(items, list) or not items:
         raise ValueError("Adicione pelo menos um item")
     normalized = []
     for idx, raw in enumerate(items, start=1):
-        if not isinstance(raw, dict):
-            raise ValueError(f"Item {idx} invalido")
-
-        quantidade_raw = raw.get("quantidade")
-        valor_raw = raw.get("valor")
-        codigo = str(raw.get("codigo", "")).strip()
-        descricao = str(raw.get("descricao", "")).strip()
-        prefixo = str(raw.get("prefixo", "")).strip()
-        estoque_raw = raw.get("estoque")
-
-        empty_line = (
-            (quantidade_raw in (None, "", 0, "0"))
-            and not codigo
-            and not descricao
-            and (valor_raw in (None, "", 0, "0", 0.0))
-            and not prefixo
-            and (estoque_raw in (None, "", 0, "0", 0.0))
-        )
-        if empty_line:
-            continue
-
-        try:
-            quantidade = int(quantidade_raw)
-        except (TypeError, ValueError):
-            raise ValueError(f"Item {idx} invalido: quantidade")
-        if quantidade <= 0:
-            raise ValueError(f"Item {idx} precisa de quantidade maior que zero")
+        item = _normalize_item(raw, idx)
+        if item is not None:
+            normalized.append(item)
 
-        try:
-            valor = float(valor_raw)
-        except (TypeError, ValueError):
-            raise ValueError(f"Item {idx} invalido: valor")
+    if not normalized:
+        raise ValueError("Adicione pelo menos um item valido")
+    return normalized
 
-        if not codigo or not descricao:
-            raise ValueError(f"Item {idx} precisa de codigo e descricao")
 
-        if estoque_raw in (None, "", 0, "0", 0.0):
-            estoque = None
-        else:
-            try:
-                estoque = int(estoque_raw)
-            except (TypeError, ValueError):
-                raise ValueError(f"Item {idx} invalido: estoque")
+EVENTO_CRIADO = "pedido_criado"
+EVENTO_ATUALIZADO = "pedido_atualizado"
+EVENTO_APROVADO = "pedido_aprovado"
+EVENTO_GERADO = "pedido_gerado"
+EVENTO_REMOVIDO = "pedido_removido"
+EVENTO_TIPOS = (EVENTO_CRIADO, EVENTO_ATUALIZADO, EVENTO_APROVADO, EVENTO_GERADO, EVENTO_REMOVIDO)
+
+
+def record_order_events(tipo: str, pedidos: list[tuple[int, str | None]]) -> None:
+    """Grava eventos (pedido_id, status) na transacao corrente; publicados no commit."""
+    if not pedidos:
+        return
+    agora = datetime.utcnow()
+    db.session.execute(
+        insert(Evento),
+        [
+            {"tipo": tipo, "pedido_id": pedido_id, "status": status, "created_at": agora}
+            for pedido_id, status in pedidos
+        ],
+    )
+    if _is_postgres():
+        # entregue aos LISTENs apenas quando a transacao for confirmada
+        db.session.execute(text("SELECT pg_notify(:canal, '')"), {"canal": EVENTOS_CANAL})
+
 
-        normalized.append(
-            {
-                "quantidade": quantidade,
-                "codigo": codigo,
-                "descricao": descricao,
-                "prefixo": prefixo,
-                "valor": valor,
-                "estoque": estoque,
-            }
-        )
+def touch_orders(pedidos, evento: str | None = None) -> int:
+    """Avanca o contador global e carimba os pedidos alterados (transacao corrente).
+
+    Com `evento`, registra tambem um evento por pedido para /api/eventos.
+    """
+    pedidos = list(pedidos)
+    bump_cache_version(CACHE_PEDIDOS)
+    versao = _current_cache_version(CACHE_PEDIDOS)
+    agora = datetime.utcnow()
+    for pedido in pedidos:
+        pedido.versao = versao
+        pedido.updated_at = agora
+    if evento:
+        record_order_events(evento, [(pedido.id, pedido.status) for pedido in pedidos])
+    return versao
 
-    if not normalized:
-        raise ValueError("Adicione pelo menos um item valido")
-    return normalized
+
+def current_orders_version() -> int:
+    return _current_cache_version(CACHE_PEDIDOS)
+
+
+def order_totals(normalized: list[dict]) -> tuple[Decimal, int]:
+    """Total (valor x quantidade) e quantidade de itens ja normalizados."""
+    total = sum(
+        (Decimal(str(item["valor"])).quantize(Decimal("0.01")) * item["quantidade"] for item in normalized),
+        Decimal("0"),
+    )
+    return total, len(normalized)
 
 
 def create_pending_order(fornecedor: str, items, creator: str | None):
@@ -511,15 +1296,19 @@ def create_pending_order(fornecedor: str, items, creator: str | None):
         raise ValueError("Selecione um fornecedor")
 
     fornecedor_registro = Fornecedor.query.filter(
-        func.upper(Fornecedor.nome) == fornecedor.upper()
+        Fornecedor.nome_norm == normalize_search_text(fornecedor)
     ).first()
     if not fornecedor_registro:
         raise ValueError("Fornecedor nao encontrado")
 
     normalized = normalize_items(items)
+    total_valor, item_count = order_totals(normalized)
 
     pedido = Pedido(
         fornecedor=fornecedor_registro.nome,
+        fornecedor_busca=normalize_search_text(fornecedor_registro.nome),
+        total_valor=total_valor,
+        item_count=item_count,
         arquivo_excel="",
         arquivo_pdf="",
         status="Pendente",
@@ -527,6 +1316,7 @@ def create_pending_order(fornecedor: str, items, creator: str | None):
     )
     db.session.add(pedido)
     db.session.flush()  # garante ID para relacionamento
+    touch_orders([pedido], EVENTO_CRIADO)
 
     for item in normalized:
         pedido.itens.append(
@@ -577,7 +1367,7 @@ def _resolve_lc_workbook_path() -> Path | None:
 
 def _ensure_supplier_exists(nome: str) -> str:
     registro = (
-        Fornecedor.query.filter(func.upper(Fornecedor.nome) == nome.upper())
+        Fornecedor.query.filter(Fornecedor.nome_norm == normalize_search_text(nome))
         .limit(1)
         .one_or_none()
     )
@@ -587,7 +1377,7 @@ def _ensure_supplier_exists(nome: str) -> str:
         return add_supplier(nome)
     except ValueError:
         registro = (
-            Fornecedor.query.filter(func.upper(Fornecedor.nome) == nome.upper())
+            Fornecedor.query.filter(Fornecedor.nome_norm == normalize_search_text(nome))
             .limit(1)
             .one_or_none()
         )
@@ -613,96 +1403,583 @@ def _coerce_positive_int(value):
     return quantidade, False
 
 
-def generate_automatic_orders_from_workbook(creator: str | None):
-    workbook_path = _resolve_lc_workbook_path()
-    if not workbook_path:
-        raise FileNotFoundError(
-            "Planilha LC.xlsx não encontrada. Defina PEDIDOS_LC_PATH ou coloque o arquivo na pasta do projeto."
-        )
+AUTO_IMPORT_BATCH_SIZE = 500
+
 
+def _lc_row_fingerprint(row_idx: int, quantidade: int, values: list[str]) -> str:
+    raw = json.dumps([row_idx, quantidade, values], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_lc_rows(workbook_path: Path):
+    """Le a planilha LC em modo streaming e devolve (linhas validas, avisos)."""
     try:
-        workbook = load_workbook(workbook_path, data_only=True)
+        workbook = load_workbook(workbook_path, read_only=True, data_only=True)
     except Exception as exc:
         raise RuntimeError(f"Não foi possível abrir {workbook_path.name}: {exc}") from exc
 
-    worksheet = workbook.active
-    supplier_name = _ensure_supplier_exists("Automatico")
-    created = 0
+    entries: list[dict] = []
     warnings: list[str] = []
+    try:
+        worksheet = workbook.active
+        rows = worksheet.iter_rows(min_row=2, max_col=21, values_only=True)
+        for row_idx, row in enumerate(rows, start=2):
+            row = tuple(row) + (None,) * (21 - len(row))
+            raw_quantity = row[2]
+            quantidade, invalid_quantity = _coerce_positive_int(raw_quantity)
+            if invalid_quantity:
+                warnings.append(f"Linha {row_idx}: quantidade inválida ({raw_quantity!r}).")
+                continue
+            if quantidade is None:
+                continue
 
-    max_row = worksheet.max_row or 0
-    for row_idx in range(2, max_row + 1):
-        raw_quantity = worksheet.cell(row=row_idx, column=3).value
-        quantidade, invalid_quantity = _coerce_positive_int(raw_quantity)
-        if invalid_quantity:
-            warnings.append(f"Linha {row_idx}: quantidade inválida ({raw_quantity!r}).")
-            continue
-        if quantidade is None:
-            continue
+            values = []
+            for cell_value in row[8:21]:
+                if cell_value in (None, "", 0, 0.0):
+                    continue
+                text_value = str(cell_value).strip()
+                if text_value:
+                    values.append(text_value)
 
-        values = []
-        for col_idx in range(9, 22):
-            cell_value = worksheet.cell(row=row_idx, column=col_idx).value
-            if cell_value in (None, "", 0, 0.0):
+            if not values:
+                warnings.append(f"Linha {row_idx}: nenhuma informação encontrada nas colunas I-U.")
                 continue
-            text = str(cell_value).strip()
-            if text:
-                values.append(text)
 
-        if not values:
-            warnings.append(f"Linha {row_idx}: nenhuma informação encontrada nas colunas I-U.")
-            continue
+            descricao = ", ".join(values)
+            entries.append(
+                {
+                    "row": row_idx,
+                    "quantidade": quantidade,
+                    "codigo": f"AUTO-{row_idx:04d}",
+                    "descricao": descricao,
+                    "fingerprint": _lc_row_fingerprint(row_idx, quantidade, values),
+                }
+            )
+    finally:
+        workbook.close()
+    return entries, warnings
 
-        descricao = ", ".join(values)
-        item_codigo = f"AUTO-{row_idx:04d}"
-        item_payload = [
-            {
-                "quantidade": quantidade,
-                "codigo": item_codigo,
-                "descricao": descricao,
-                "prefixo": "",
-                "valor": 0,
-                "estoque": None,
-            }
-        ]
 
-        try:
-            create_pending_order(supplier_name, item_payload, creator)
-            created += 1
-        except ValueError as exc:
-            warnings.append(f"Linha {row_idx}: {exc}")
-        except Exception as exc:
-            warnings.append(f"Linha {row_idx}: erro inesperado ({exc}).")
-            logger.exception("Falha ao criar pedido automático para linha %s", row_idx)
+def _bulk_insert_automatic_orders(entries: list[dict], supplier_name: str, creator: str | None) -> list[int]:
+    """Insere pedidos e itens em lotes (executemany); o commit fica com o chamador."""
+    created_by = (creator or "").upper() or None
+    fornecedor_busca = normalize_search_text(supplier_name)
+    created_ids: list[int] = []
+    for offset in range(0, len(entries), AUTO_IMPORT_BATCH_SIZE):
+        batch = entries[offset : offset + AUTO_IMPORT_BATCH_SIZE]
+        now = datetime.utcnow()
+        versao = touch_orders([])
+        pedido_ids = db.session.scalars(
+            insert(Pedido).returning(Pedido.id, sort_by_parameter_order=True),
+            [
+                {
+                    "fornecedor": supplier_name,
+                    "fornecedor_busca": fornecedor_busca,
+                    "arquivo_excel": "",
+                    "arquivo_pdf": "",
+                    "status": "Pendente",
+                    "created_by": created_by,
+                    "created_at": now,
+                    "updated_at": now,
+                    # cada pedido automatico tem um unico item com valor zero
+                    "total_valor": Decimal("0"),
+                    "item_count": 1,
+                    "versao": versao,
+                }
+                for _ in batch
+            ],
+        ).all()
+        db.session.execute(
+            insert(PedidoItem),
+            [
+                {
+                    "pedido_id": pedido_id,
+                    "codigo": entry["codigo"],
+                    "descricao": entry["descricao"],
+                    "quantidade": entry["quantidade"],
+                    "prefixo": "",
+                    "valor": Decimal("0"),
+                    "estoque": None,
+                }
+                for pedido_id, entry in zip(pedido_ids, batch)
+            ],
+        )
+        record_order_events(EVENTO_CRIADO, [(pedido_id, "Pendente") for pedido_id in pedido_ids])
+        created_ids.extend(pedido_ids)
+    return created_ids
 
-    return {
-        "created": created,
-        "warnings": warnings,
+
+def _record_lc_fingerprints(importacao_id: int, entries: list[dict], pedido_ids: list[int]) -> None:
+    rows = [entry["row"] for entry in entries]
+    for offset in range(0, len(rows), AUTO_IMPORT_BATCH_SIZE):
+        chunk = rows[offset : offset + AUTO_IMPORT_BATCH_SIZE]
+        db.session.execute(
+            ImportacaoLCLinha.__table__.delete().where(
+                ImportacaoLCLinha.importacao_id == importacao_id,
+                ImportacaoLCLinha.linha.in_(chunk),
+            )
+        )
+    if entries:
+        db.session.execute(
+            insert(ImportacaoLCLinha),
+            [
+                {
+                    "importacao_id": importacao_id,
+                    "linha": entry["row"],
+                    "fingerprint": entry["fingerprint"],
+                    "pedido_id": pedido_id,
+                }
+                for entry, pedido_id in zip(entries, pedido_ids)
+            ],
+        )
+
+
+@medir_duracao("pedidos_lc_importacao_seconds")
+def generate_automatic_orders_from_workbook(creator: str | None):
+    """Importa a planilha LC de forma incremental.
+
+    Uma execucao sem alteracoes na planilha (mtime/tamanho ou hash iguais)
+    retorna sem abrir o arquivo; caso contrario, apenas linhas novas ou
+    alteradas (numero da linha + quantidade + colunas I-U) geram pedidos.
+    """
+    workbook_path = _resolve_lc_workbook_path()
+    if not workbook_path:
+        raise FileNotFoundError(
+            "Planilha LC.xlsx não encontrada. Defina PEDIDOS_LC_PATH ou coloque o arquivo na pasta do projeto."
+        )
+
+    result = {
+        "created": 0,
+        "skipped": 0,
+        "unchanged": False,
+        "warnings": [],
         "workbook": workbook_path,
     }
+    stat = workbook_path.stat()
+    estado = ImportacaoLC.query.filter_by(caminho=str(workbook_path)).one_or_none()
+    if estado and estado.mtime == stat.st_mtime and estado.tamanho == stat.st_size:
+        result["unchanged"] = True
+        return result
 
+    sha256 = _file_sha256(workbook_path)
+    if estado is not None and estado.sha256 == sha256:
+        estado.mtime = stat.st_mtime
+        estado.tamanho = stat.st_size
+        db.session.commit()
+        result["unchanged"] = True
+        return result
 
-
-
-def list_orders(fornecedor: str | None = None, status: str | None = None):
-    query = Pedido.query
-    if fornecedor:
-        query = query.filter(Pedido.fornecedor.ilike(f"%{fornecedor.strip()}%"))
-    if status:
-        query = query.filter(Pedido.status == status)
-    pedidos = query.order_by(Pedido.created_at.desc()).all()
-    return [
-        {
-            "id": pedido.id,
-            "fornecedor": pedido.fornecedor,
-            "created_by": pedido.created_by,
-            "created_at": pedido.created_at.isoformat() if pedido.created_at else None,
-            "status": pedido.status,
-            "arquivo_excel": pedido.arquivo_excel or "",
-            "arquivo_pdf": pedido.arquivo_pdf or "",
-        }
-        for pedido in pedidos
+    entries, warnings = _read_lc_rows(workbook_path)
+    result["warnings"] = warnings
+
+    # impressoes digitais sao por planilha: outro PEDIDOS_LC_PATH comeca do zero
+    known = {}
+    if estado is not None:
+        known = dict(
+            db.session.query(ImportacaoLCLinha.linha, ImportacaoLCLinha.fingerprint)
+            .filter(ImportacaoLCLinha.importacao_id == estado.id)
+            .all()
+        )
+    pending = [entry for entry in entries if known.get(entry["row"]) != entry["fingerprint"]]
+    result["skipped"] = len(entries) - len(pending)
+
+    supplier_name = _ensure_supplier_exists("Automatico") if pending else None
+    try:
+        if estado is None:
+            estado = ImportacaoLC(caminho=str(workbook_path))
+        estado.mtime = stat.st_mtime
+        estado.tamanho = stat.st_size
+        estado.sha256 = sha256
+        estado.importado_em = datetime.utcnow()
+        db.session.add(estado)
+        db.session.flush()
+        if pending:
+            pedido_ids = _bulk_insert_automatic_orders(pending, supplier_name, creator)
+            _record_lc_fingerprints(estado.id, pending, pedido_ids)
+            result["created"] = len(pedido_ids)
+            incrementar_metrica("pedidos_lc_importacao_pedidos_total", len(pedido_ids))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("Falha ao importar pedidos automáticos")
+        raise
+    return result
+
+
+LIST_ORDERS_DEFAULT_LIMIT = 50
+LIST_ORDERS_MAX_LIMIT = 200
+
+# Colunas serializadas na listagem; evita carregar entidades/itens completos
+_LISTING_COLUMNS = (
+    Pedido.id,
+    Pedido.fornecedor,
+    Pedido.created_by,
+    Pedido.created_at,
+    Pedido.status,
+    Pedido.arquivo_excel,
+    Pedido.arquivo_pdf,
+    Pedido.total_valor,
+    Pedido.item_count,
+)
+
+
+def _serialize_listing_row(row) -> dict:
+    return {
+        "id": row.id,
+        "fornecedor": row.fornecedor,
+        "created_by": row.created_by,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "status": row.status,
+        "arquivo_excel": row.arquivo_excel or "",
+        "arquivo_pdf": row.arquivo_pdf or "",
+        "total_valor": float(row.total_valor or 0),
+        "item_count": row.item_count or 0,
+    }
+
+
+def encode_orders_cursor(created_at: datetime, pedido_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), pedido_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_orders_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at_raw, pedido_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(created_at_raw), int(pedido_id)
+    except (ValueError, TypeError, UnicodeError) as exc:
+        raise ValueError("Cursor invalido") from exc
+
+
+def parse_filter_date(value: str | None, end_of_day: bool = False) -> datetime | None:
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise ValueError(f"Data invalida: {value}") from exc
+    if parsed.tzinfo is not None:
+        # datas com fuso sao comparadas em UTC, como as colunas do banco
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_of_day and len(value) <= 10:
+        # data sem horario: inclui o dia inteiro
+        parsed = parsed + timedelta(days=1)
+    return parsed
+
+
+def _listing_query(
+    fornecedor: str | None = None,
+    status: str | None = None,
+    desde: datetime | None = None,
+    ate: datetime | None = None,
+    created_by: str | None = None,
+):
+    return _filter_orders(
+        db.session.query(*_LISTING_COLUMNS), fornecedor, status, desde, ate, created_by
+    )
+
+
+def _filter_orders(
+    query,
+    fornecedor: str | None = None,
+    status: str | None = None,
+    desde: datetime | None = None,
+    ate: datetime | None = None,
+    created_by: str | None = None,
+):
+    if fornecedor:
+        # busca por trecho do nome nos dois bancos
+        if _is_postgres():
+            # atendido pelo indice trigram (pg_trgm)
+            query = query.filter(Pedido.fornecedor.ilike(like_substring(fornecedor.strip()), escape="\\"))
+        else:
+            # SQLite nao tem indice trigram: percorre a coluna normalizada
+            trecho = like_substring(normalize_search_text(fornecedor))
+            query = query.filter(Pedido.fornecedor_busca.like(trecho, escape="\\"))
+    if status:
+        query = query.filter(Pedido.status == status)
+    if created_by:
+        query = query.filter(Pedido.created_by == created_by.strip().upper())
+    if desde:
+        query = query.filter(Pedido.created_at >= desde)
+    if ate:
+        query = query.filter(Pedido.created_at < ate)
+    return query
+
+
+def list_orders(
+    fornecedor: str | None = None,
+    status: str | None = None,
+    desde: datetime | None = None,
+    ate: datetime | None = None,
+    created_by: str | None = None,
+):
+    rows = (
+        _listing_query(fornecedor, status, desde, ate, created_by)
+        .order_by(Pedido.created_at.desc(), Pedido.id.desc())
+        .all()
+    )
+    return [_serialize_listing_row(row) for row in rows]
+
+
+def list_orders_page(
+    fornecedor: str | None = None,
+    status: str | None = None,
+    desde: datetime | None = None,
+    ate: datetime | None = None,
+    created_by: str | None = None,
+    limit: int = LIST_ORDERS_DEFAULT_LIMIT,
+    cursor: str | None = None,
+) -> dict:
+    """Pagina por (created_at, id) decrescente; o custo independe do historico."""
+    limit = max(1, min(int(limit), LIST_ORDERS_MAX_LIMIT))
+    query = _listing_query(fornecedor, status, desde, ate, created_by)
+    if cursor:
+        cursor_created_at, cursor_id = decode_orders_cursor(cursor)
+        query = query.filter(
+            or_(
+                Pedido.created_at < cursor_created_at,
+                and_(Pedido.created_at == cursor_created_at, Pedido.id < cursor_id),
+            )
+        )
+    rows = (
+        query.order_by(Pedido.created_at.desc(), Pedido.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_orders_cursor(last.created_at, last.id)
+    return {
+        "pedidos": [_serialize_listing_row(row) for row in rows],
+        "next_cursor": next_cursor,
+    }
+
+
+def list_orders_changes(
+    since: datetime,
+    fornecedor: str | None = None,
+    status: str | None = None,
+    desde: datetime | None = None,
+    ate: datetime | None = None,
+    created_by: str | None = None,
+) -> dict:
+    """Pedidos alterados desde `since` que atendem aos filtros.
+
+    `removidos` traz os ids que o cliente deve retirar: pedidos excluidos e
+    pedidos alterados que deixaram de atender aos filtros. Se `since` for
+    anterior ao horizonte dos removidos, devolve a listagem completa com
+    `reset` e o cliente substitui o estado local.
+    """
+    agora = datetime.utcnow()
+    filtros = dict(fornecedor=fornecedor, status=status, desde=desde, ate=ate, created_by=created_by)
+    if since < agora - timedelta(days=SYNC_HORIZONTE_DIAS):
+        return {
+            "pedidos": list_orders(**filtros),
+            "removidos": [],
+            "reset": True,
+            "server_time": agora.isoformat(),
+        }
+
+    limite = since - SYNC_SOBREPOSICAO
+    rows = (
+        _listing_query(**filtros)
+        .filter(Pedido.updated_at >= limite)
+        .order_by(Pedido.created_at.desc(), Pedido.id.desc())
+        .all()
+    )
+    visiveis = {row.id for row in rows}
+    alterados = {
+        pedido_id
+        for (pedido_id,) in db.session.query(Pedido.id).filter(Pedido.updated_at >= limite)
+    }
+    excluidos = {
+        pedido_id
+        for (pedido_id,) in db.session.query(PedidoRemovido.pedido_id).filter(
+            PedidoRemovido.removido_em >= limite
+        )
+    }
+    return {
+        "pedidos": [_serialize_listing_row(row) for row in rows],
+        "removidos": sorted((alterados - visiveis) | excluidos),
+        "reset": False,
+        "server_time": agora.isoformat(),
+    }
+
+
+def summarize_orders(
+    fornecedor: str | None = None,
+    status: str | None = None,
+    desde: datetime | None = None,
+    ate: datetime | None = None,
+    created_by: str | None = None,
+) -> dict:
+    """Contagens e totais agregados no banco (GROUP BY), sem carregar pedidos."""
+    total_expr = db.func.coalesce(db.func.sum(Pedido.total_valor), 0)
+
+    def _grouped(column):
+        query = db.session.query(column, db.func.count(Pedido.id), total_expr)
+        return (
+            _filter_orders(query, fornecedor, status, desde, ate, created_by)
+            .group_by(column)
+            .order_by(column)
+            .all()
+        )
+
+    por_status = [
+        {"status": nome, "pedidos": quantidade, "total_valor": float(total)}
+        for nome, quantidade, total in _grouped(Pedido.status)
     ]
+    por_fornecedor = [
+        {"fornecedor": nome, "pedidos": quantidade, "total_valor": float(total)}
+        for nome, quantidade, total in _grouped(Pedido.fornecedor)
+    ]
+    return {
+        "pedidos": sum(grupo["pedidos"] for grupo in por_status),
+        "total_valor": round(sum(grupo["total_valor"] for grupo in por_status), 2),
+        "por_status": por_status,
+        "por_fornecedor": por_fornecedor,
+    }
+
+
+EXPORT_LOTE = 1000
+EXPORT_COLUNAS = (
+    "pedido",
+    "fornecedor",
+    "status",
+    "criado_por",
+    "criado_em",
+    "codigo",
+    "prefixo",
+    "descricao",
+    "quantidade",
+    "valor",
+    "total",
+    "estoque",
+)
+
+
+def iter_export_rows(
+    fornecedor: str | None = None,
+    status: str | None = None,
+    desde: datetime | None = None,
+    ate: datetime | None = None,
+    created_by: str | None = None,
+):
+    """Linhas pedido x item, lidas do banco em lotes (cursor no servidor)."""
+    query = db.session.query(
+        Pedido.id,
+        Pedido.fornecedor,
+        Pedido.status,
+        Pedido.created_by,
+        Pedido.created_at,
+        PedidoItem.codigo,
+        PedidoItem.prefixo,
+        PedidoItem.descricao,
+        PedidoItem.quantidade,
+        PedidoItem.valor,
+        PedidoItem.estoque,
+    ).outerjoin(PedidoItem, PedidoItem.pedido_id == Pedido.id)
+    query = (
+        _filter_orders(query, fornecedor, status, desde, ate, created_by)
+        .order_by(Pedido.created_at.desc(), Pedido.id.desc(), PedidoItem.id)
+        .yield_per(EXPORT_LOTE)
+    )
+    for row in query:
+        # pedidos sem itens saem com as colunas de item vazias (outer join)
+        tem_item = row.valor is not None and row.quantidade is not None
+        yield (
+            row.id,
+            row.fornecedor,
+            row.status,
+            row.created_by or "",
+            row.created_at,
+            row.codigo or "",
+            row.prefixo or "",
+            row.descricao or "",
+            row.quantidade,
+            row.valor,
+            row.valor * row.quantidade if tem_item else None,
+            row.estoque,
+        )
+
+
+# Texto iniciado por estes caracteres vira formula no Excel (injecao via CSV)
+_FORMULA_INICIO = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, str) and value.startswith(_FORMULA_INICIO):
+        return "'" + value
+    return value
+
+
+def _xlsx_row(ws, row) -> list:
+    celulas = []
+    for value in row:
+        if isinstance(value, str) and value.startswith("="):
+            # o openpyxl grava texto iniciado por "=" como formula
+            celula = WriteOnlyCell(ws, value=value)
+            celula.data_type = "s"
+            value = celula
+        celulas.append(value)
+    return celulas
+
+
+def export_orders_csv(**filtros):
+    """Gera o CSV em pedacos; o primeiro byte sai antes da consulta terminar."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM: o Excel abre o arquivo como UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUNAS)
+    for numero, row in enumerate(iter_export_rows(**filtros), start=1):
+        row = list(row)
+        row[4] = row[4].isoformat(sep=" ", timespec="seconds") if row[4] else ""
+        writer.writerow([_csv_cell(value) for value in row])
+        if numero % EXPORT_LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_orders_xlsx(**filtros):
+    """Gera o XLSX em modo write_only (memoria constante) e o envia em pedacos.
+
+    O zip do XLSX so fica completo no save, por isso o arquivo e montado num
+    temporario antes de ser transmitido.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Pedidos")
+    ws.append(EXPORT_COLUNAS)
+    for row in iter_export_rows(**filtros):
+        ws.append(_xlsx_row(ws, row))
+    handle = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+    handle.close()
+    try:
+        wb.save(handle.name)
+        with open(handle.name, "rb") as arquivo:
+            while True:
+                pedaco = arquivo.read(64 * 1024)
+                if not pedaco:
+                    break
+                yield pedaco
+    finally:
+        os.unlink(handle.name)
 
 
 def get_order(order_id: int):
@@ -713,6 +1990,10 @@ def get_order(order_id: int):
     )
     if not pedido:
         return None
+    return serialize_order(pedido)
+
+
+def serialize_order(pedido: Pedido) -> dict:
     itens_list = []
     for item in pedido.itens:
         valor = float(item.valor or 0)
@@ -737,30 +2018,57 @@ def get_order(order_id: int):
         "status": pedido.status,
         "arquivo_excel": pedido.arquivo_excel or "",
         "arquivo_pdf": pedido.arquivo_pdf or "",
+        "total_valor": float(pedido.total_valor or 0),
+        "item_count": pedido.item_count or 0,
         "itens": itens_list,
         "arquivo_excel_path": resolve_pedido_excel_path(pedido.arquivo_excel),
     }
 
 
-def update_pending_order(order_id: int, items):
-    normalized = normalize_items(items)
-    pedido = Pedido.query.filter_by(id=order_id).first()
+_ITEM_CAMPOS = ("codigo", "descricao", "quantidade", "prefixo", "valor", "estoque")
+
+
+def _new_order_item(item: dict) -> PedidoItem:
+    return PedidoItem(
+        codigo=item["codigo"],
+        descricao=item["descricao"],
+        quantidade=item["quantidade"],
+        prefixo=item["prefixo"],
+        valor=Decimal(str(item["valor"])),
+        estoque=item["estoque"],
+    )
+
+
+def _apply_item_fields(registro: PedidoItem, item: dict) -> None:
+    # atribui so o que mudou: linhas iguais nao geram UPDATE
+    valor = Decimal(str(item["valor"]))
+    if registro.valor is None or Decimal(registro.valor).quantize(Decimal("0.01")) != valor.quantize(
+        Decimal("0.01")
+    ):
+        registro.valor = valor
+    for campo in ("codigo", "descricao", "quantidade", "prefixo", "estoque"):
+        if getattr(registro, campo) != item[campo]:
+            setattr(registro, campo, item[campo])
+
+
+def _load_pending_order(order_id: int) -> Pedido:
+    pedido = (
+        Pedido.query.options(selectinload(Pedido.itens))
+        .filter_by(id=order_id)
+        .first()
+    )
     if not pedido:
         raise ValueError("Pedido nao encontrado")
     if pedido.status != "Pendente":
         raise ValueError("Somente pedidos pendentes podem ser alterados")
-    pedido.itens.clear()
-    for item in normalized:
-        pedido.itens.append(
-            PedidoItem(
-                codigo=item["codigo"],
-                descricao=item["descricao"],
-                quantidade=item["quantidade"],
-                prefixo=item["prefixo"],
-                valor=Decimal(str(item["valor"])),
-                estoque=item["estoque"],
-            )
-        )
+    return pedido
+
+
+def _commit_item_changes(pedido: Pedido) -> None:
+    pedido.total_valor, pedido.item_count = order_totals(
+        [{"valor": item.valor, "quantidade": item.quantidade} for item in pedido.itens]
+    )
+    touch_orders([pedido], EVENTO_ATUALIZADO)
     try:
         db.session.commit()
     except Exception:
@@ -769,6 +2077,84 @@ def update_pending_order(order_id: int, items):
         raise
 
 
+def update_pending_order(order_id: int, items):
+    """Substitui a lista de itens emitindo apenas o INSERT/UPDATE/DELETE necessario.
+
+    Itens com `id` do proprio pedido sao atualizados no lugar; itens sem `id`
+    reaproveitam, na ordem, as linhas existentes que nao foram referenciadas
+    (clientes antigos) e o que sobrar de cada lado vira INSERT ou DELETE.
+    """
+    normalized = normalize_items(items)
+    pedido = _load_pending_order(order_id)
+    existentes = {registro.id: registro for registro in pedido.itens}
+    referenciados = {item["id"] for item in normalized if item["id"] in existentes}
+    livres = [registro for registro in pedido.itens if registro.id not in referenciados]
+    usados = set()
+    for item in normalized:
+        registro = existentes.get(item["id"])
+        if registro is None or registro.id in usados:
+            registro = livres.pop(0) if livres else None
+        if registro is None:
+            pedido.itens.append(_new_order_item(item))
+            continue
+        usados.add(registro.id)
+        _apply_item_fields(registro, item)
+    for registro in livres:
+        pedido.itens.remove(registro)
+    _commit_item_changes(pedido)
+
+
+def patch_pending_order_items(order_id: int, adicionar=None, alterar=None, remover=None) -> None:
+    """Aplica operacoes pontuais nos itens: `adicionar` (itens novos), `alterar`
+    (dicts com `id` e os campos a mudar) e `remover` (ids)."""
+    adicionar = adicionar or []
+    alterar = alterar or []
+    remover = remover or []
+    if not isinstance(adicionar, list) or not isinstance(alterar, list) or not isinstance(remover, list):
+        raise ValueError("Operacoes invalidas")
+    if not (adicionar or alterar or remover):
+        raise ValueError("Nenhuma alteracao informada")
+    pedido = _load_pending_order(order_id)
+    existentes = {registro.id: registro for registro in pedido.itens}
+    try:
+        for raw in alterar:
+            item_id = raw.get("id") if isinstance(raw, dict) else None
+            try:
+                registro = existentes.get(int(item_id))
+            except (TypeError, ValueError):
+                registro = None
+            if registro is None:
+                raise ValueError(f"Item {item_id} nao pertence ao pedido")
+            atual = {campo: getattr(registro, campo) for campo in _ITEM_CAMPOS}
+            atual.update({campo: raw[campo] for campo in _ITEM_CAMPOS if campo in raw})
+            item = _normalize_item(atual, registro.id)
+            if item is None:
+                raise ValueError(f"Item {registro.id} invalido")
+            _apply_item_fields(registro, item)
+
+        for item_id in remover:
+            try:
+                registro = existentes.pop(int(item_id), None)
+            except (TypeError, ValueError):
+                registro = None
+            if registro is None:
+                raise ValueError(f"Item {item_id} nao pertence ao pedido")
+            pedido.itens.remove(registro)
+
+        for idx, raw in enumerate(adicionar, start=1):
+            item = _normalize_item(raw, f"novo {idx}")
+            if item is not None:
+                pedido.itens.append(_new_order_item(item))
+
+        if not pedido.itens:
+            raise ValueError("Adicione pelo menos um item")
+    except ValueError:
+        # descarta as alteracoes parciais ja aplicadas a sessao
+        db.session.rollback()
+        raise
+    _commit_item_changes(pedido)
+
+
 def approve_order(order_id: int, approver: str | None):
     pedido = Pedido.query.filter_by(id=order_id).first()
     if not pedido:
@@ -778,14 +2164,50 @@ def approve_order(order_id: int, approver: str | None):
     pedido.status = "Aprovado"
     if approver:
         pedido.created_by = pedido.created_by or approver
+    touch_orders([pedido], EVENTO_APROVADO)
     db.session.add(pedido)
     db.session.commit()
 
 
+def approve_orders(order_ids: list[int], approver: str | None) -> tuple[list[int], dict]:
+    """Aprova varios pedidos numa unica transacao; devolve (aprovados, erros por id)."""
+    erros: dict[int, str] = {}
+    pedidos = {
+        pedido.id: pedido
+        for pedido in Pedido.query.filter(Pedido.id.in_(order_ids)).all()
+    }
+    aprovados = []
+    for order_id in order_ids:
+        pedido = pedidos.get(order_id)
+        if not pedido:
+            erros[order_id] = "Pedido nao encontrado"
+            continue
+        if pedido.status != "Pendente":
+            erros[order_id] = "Pedido ja foi processado"
+            continue
+        pedido.status = "Aprovado"
+        if approver:
+            pedido.created_by = pedido.created_by or approver
+        aprovados.append(order_id)
+    if aprovados:
+        touch_orders((pedidos[order_id] for order_id in aprovados), EVENTO_APROVADO)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("Falha ao aprovar pedidos em lote")
+        raise
+    return aprovados, erros
+
+
 def build_order_payload(order_id: int):
     pedido = get_order(order_id)
     if not pedido:
         raise ValueError("Pedido nao encontrado")
+    return order_payload_from_serialized(pedido)
+
+
+def order_payload_from_serialized(pedido: dict):
     created_at = pedido.get("created_at") or ""
     created_dt = None
     if created_at:
@@ -819,77 +2241,558 @@ def build_order_payload(order_id: int):
     return payload
 
 
+# Cache de geracao: se payload e modelo nao mudaram, o arquivo existente e reutilizado
+_geracao_cache_lock = threading.Lock()
+_geracao_cache_stats = {"hits": 0, "misses": 0}
+_modelo_version_cache: dict = {"key": None, "version": None}
+
+
+def generation_cache_stats() -> dict:
+    with _geracao_cache_lock:
+        return dict(_geracao_cache_stats)
+
+
+def _count_generation_cache(hit: bool) -> None:
+    with _geracao_cache_lock:
+        _geracao_cache_stats["hits" if hit else "misses"] += 1
+    incrementar_metrica("pedidos_planilha_cache_total", resultado="hit" if hit else "miss")
+
+
+def modelo_template_version() -> str:
+    """Hash do conteudo do modelo, recalculado so quando mtime/tamanho mudam."""
+    if not MODELO_PATH.exists():
+        raise FileNotFoundError(
+            "Modelo modelo_pedido.xlsm nao encontrado. Verifique o caminho configurado."
+        )
+    stat = MODELO_PATH.stat()
+    key = (str(MODELO_PATH), stat.st_mtime_ns, stat.st_size)
+    with _modelo_cache_lock:
+        if _modelo_version_cache["key"] != key:
+            _modelo_version_cache.update(key=key, version=_file_sha256(MODELO_PATH))
+        return _modelo_version_cache["version"]
+
+
+def order_file_fingerprint(payload: dict) -> str:
+    conteudo = {
+        "numero": payload["numero"],
+        "fornecedor": payload["fornecedor"],
+        "data": payload["data"].isoformat(),
+        "itens": payload["itens"],
+        "modelo": modelo_template_version(),
+        "engine": PLANILHA_ENGINE,
+    }
+    raw = json.dumps(conteudo, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cached_order_file(pedido: Pedido, fingerprint: str) -> str | None:
+    caminho = None
+    if pedido.arquivo_excel and pedido.arquivo_fingerprint == fingerprint:
+        candidato = resolve_pedido_excel_path(pedido.arquivo_excel)
+        if candidato and os.path.exists(candidato):
+            caminho = candidato
+    _count_generation_cache(caminho is not None)
+    return caminho
+
+
+def _mark_order_generated(pedido: Pedido, caminho: str, fingerprint: str) -> None:
+    pedido.arquivo_excel = Path(caminho).name
+    pedido.arquivo_fingerprint = fingerprint
+    pedido.status = "Gerado"
+
+
 def generate_order_file(order_id: int):
     payload = build_order_payload(order_id)
     if payload["status"] not in {"Aprovado", "Gerado"}:
         raise ValueError("Pedido precisa estar aprovado para gerar arquivo")
-    caminho = gerar_arquivo_pedido_aprovado_arquivo(payload)
-    pedido = Pedido.query.get(order_id)
+    pedido = db.session.get(Pedido, order_id)
     if not pedido:
         raise ValueError("Pedido nao encontrado")
-    pedido.arquivo_excel = Path(caminho).name
-    pedido.status = "Gerado"
+    fingerprint = order_file_fingerprint(payload)
+    caminho = _cached_order_file(pedido, fingerprint)
+    if caminho is None:
+        caminho = gerar_arquivo_pedido_aprovado_arquivo(payload)
+    _mark_order_generated(pedido, caminho, fingerprint)
+    touch_orders([pedido], EVENTO_GERADO)
     db.session.add(pedido)
     db.session.commit()
     return caminho
 
 
-def gerar_arquivo_pedido_aprovado_arquivo(pedido_payload):
+# Modelo de pedido lido, validado e serializado uma unica vez por mtime;
+# cada pedido parte de uma copia desserializada em memoria.
+_modelo_cache_lock = threading.Lock()
+_modelo_cache: dict = {"key": None, "snapshot": None, "sheet": None}
+
+
+def _load_modelo_template() -> tuple[bytes, str]:
     if not MODELO_PATH.exists():
         raise FileNotFoundError(
             "Modelo modelo_pedido.xlsm nao encontrado. Verifique o caminho configurado."
         )
+    stat = MODELO_PATH.stat()
+    key = (str(MODELO_PATH), stat.st_mtime_ns, stat.st_size)
+    with _modelo_cache_lock:
+        if _modelo_cache["key"] == key:
+            return _modelo_cache["snapshot"], _modelo_cache["sheet"]
 
+        try:
+            wb = load_workbook(str(MODELO_PATH))
+        except PermissionError as exc:
+            raise ValueError("O modelo esta em uso. Feche o Excel e tente novamente.") from exc
+        try:
+            nome_aba = None
+            for sheet in wb.sheetnames:
+                if "IMPRESSAO" in sheet.upper():
+                    nome_aba = sheet
+                    break
+            if not nome_aba:
+                raise ValueError("Aba de impressao nao encontrada no modelo.")
+            snapshot = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            wb.close()
+
+        _modelo_cache.update(key=key, snapshot=snapshot, sheet=nome_aba)
+        logger.info("Modelo de pedido carregado em cache (%s)", MODELO_PATH.name)
+        return snapshot, nome_aba
+
+
+def _order_cell_values(pedido_payload) -> dict:
+    """Celulas da aba IMPRESSAO preenchidas para um pedido (referencia -> valor)."""
+    try:
+        cells = {
+            "AG2": pedido_payload["numero"],
+            "V6": pedido_payload["data"].day,
+            "X6": pedido_payload["data"].month,
+            "AG6": pedido_payload["data"].year,
+            "G8": pedido_payload["fornecedor"],
+        }
+    except Exception as exc:
+        raise ValueError(f"Erro ao preencher campos do modelo: {exc}") from exc
+
+    linha_inicial = 15
+    for index, item in enumerate(pedido_payload["itens"]):
+        linha = linha_inicial + index
+        cells[f"A{linha}"] = item["quantidade"]
+        cells[f"F{linha}"] = item["prefixo"]
+        cells[f"J{linha}"] = item["codigo"]
+        cells[f"K{linha}"] = item["descricao"]
+        cells[f"X{linha}"] = item["valor_unitario"]
+    return cells
+
+
+def _order_output_path(pedido_payload) -> Path:
     fornecedor_limpo = "".join(
         c for c in pedido_payload["fornecedor"] if c.isalnum() or c in (" ", "_", "-")
     ).strip()
     fornecedor_limpo = fornecedor_limpo.replace(" ", "_") or "FORNECEDOR"
     data_str = pedido_payload["data"].strftime("%Y-%m-%d")
     nome_arquivo = f"{fornecedor_limpo}_{pedido_payload['numero']}_{data_str}.xlsx"
-    caminho_saida = PASTA_PEDIDOS_APROVADOS / nome_arquivo
+    return PASTA_PEDIDOS_APROVADOS / nome_arquivo
+
+
+_generation_pool: ProcessPoolExecutor | None = None
+_generation_pool_lock = threading.Lock()
+
+
+def _get_generation_pool() -> ProcessPoolExecutor:
+    global _generation_pool
+    with _generation_pool_lock:
+        if _generation_pool is None:
+            # nada de fork: o worker tem threads (jobs, retencao, SSE) que podem
+            # estar segurando locks (_metricas_lock, _modelo_cache_lock) no fork
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _generation_pool = ProcessPoolExecutor(
+                max_workers=max(1, GERACAO_PROCESSOS),
+                mp_context=multiprocessing.get_context(metodo),
+            )
+        return _generation_pool
+
 
+def _discard_generation_pool(pool: ProcessPoolExecutor) -> None:
+    """Descarta um pool travado/quebrado; a proxima chamada cria outro."""
+    global _generation_pool
+    with _generation_pool_lock:
+        if _generation_pool is pool:
+            _generation_pool = None
+    # shutdown nao interrompe processos presos numa tarefa
+    for processo in list((getattr(pool, "_processes", None) or {}).values()):
+        processo.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _generate_order_file_in_process(pedido_payload, engine: str) -> tuple[str, float]:
+    """Executado nos processos do pool: so gera o arquivo, sem metricas.
+
+    A duracao volta para o processo pai, que registra a metrica.
+    """
+    inicio = time.perf_counter()
+    caminho = _write_order_file(pedido_payload, engine)
+    return caminho, time.perf_counter() - inicio
+
+
+@medir_duracao("pedidos_planilha_lote_seconds")
+def generate_order_files(order_ids: list[int]) -> dict:
+    """Gera as planilhas de varios pedidos em paralelo (pool de processos).
+
+    Os payloads sao montados com uma consulta so; os processos apenas
+    preenchem o modelo, e o status/arquivo de todos os pedidos e gravado
+    numa unica transacao. Devolve {id: caminho ou excecao}.
+    """
+    pedidos = (
+        Pedido.query.options(selectinload(Pedido.itens))
+        .filter(Pedido.id.in_(order_ids))
+        .all()
+    )
+    por_id = {pedido.id: pedido for pedido in pedidos}
+    resultados: dict[int, object] = {}
+    payloads = {}
+    fingerprints = {}
+    for order_id in order_ids:
+        pedido = por_id.get(order_id)
+        if not pedido:
+            resultados[order_id] = ValueError("Pedido nao encontrado")
+            continue
+        try:
+            payload = order_payload_from_serialized(serialize_order(pedido))
+            if payload["status"] not in {"Aprovado", "Gerado"}:
+                raise ValueError("Pedido precisa estar aprovado para gerar arquivo")
+        except ValueError as exc:
+            resultados[order_id] = exc
+            continue
+        fingerprints[order_id] = order_file_fingerprint(payload)
+        caminho = _cached_order_file(pedido, fingerprints[order_id])
+        if caminho is not None:
+            resultados[order_id] = caminho
+            continue
+        payloads[order_id] = payload
+
+    if GERACAO_PROCESSOS <= 0 or len(payloads) <= 1:
+        for order_id, payload in payloads.items():
+            try:
+                resultados[order_id] = gerar_arquivo_pedido_aprovado_arquivo(payload)
+            except Exception as exc:
+                resultados[order_id] = exc
+    else:
+        pool = _get_generation_pool()
+        futures = {
+            order_id: pool.submit(_generate_order_file_in_process, payload, PLANILHA_ENGINE)
+            for order_id, payload in payloads.items()
+        }
+        limite = time.monotonic() + GERACAO_TIMEOUT
+        descartar = False
+        for order_id, future in futures.items():
+            try:
+                caminho, duracao = future.result(timeout=max(0.0, limite - time.monotonic()))
+            except FuturesTimeoutError:
+                descartar = True
+                future.cancel()
+                resultados[order_id] = TimeoutError("Tempo esgotado ao gerar a planilha")
+            except BrokenProcessPool as exc:
+                descartar = True
+                resultados[order_id] = exc
+            except Exception as exc:
+                resultados[order_id] = exc
+            else:
+                observar_metrica("pedidos_planilha_geracao_seconds", duracao, engine=PLANILHA_ENGINE)
+                resultados[order_id] = caminho
+        if descartar:
+            logger.error("Pool de geracao descartado (tempo esgotado ou processo morto)")
+            _discard_generation_pool(pool)
+
+    gerados = []
+    for order_id, resultado in resultados.items():
+        if isinstance(resultado, str):
+            _mark_order_generated(por_id[order_id], resultado, fingerprints[order_id])
+            gerados.append(por_id[order_id])
+    if gerados:
+        touch_orders(gerados, EVENTO_GERADO)
     try:
-        shutil.copy(str(MODELO_PATH), str(caminho_saida))
-    except PermissionError as exc:
-        raise ValueError("O modelo esta em uso. Feche o Excel e tente novamente.") from exc
+        db.session.commit()
     except Exception:
-        logger.exception("Erro ao copiar modelo")
+        db.session.rollback()
+        logger.exception("Falha ao registrar arquivos gerados em lote")
         raise
+    return resultados
 
-    wb = load_workbook(str(caminho_saida))
 
-    nome_aba = None
-    for sheet in wb.sheetnames:
-        if "IMPRESSAO" in sheet.upper():
-            nome_aba = sheet
-            break
-    if not nome_aba:
-        wb.close()
-        raise ValueError("Aba de impressao nao encontrada no modelo.")
+def _write_order_file(pedido_payload, engine: str) -> str:
+    cells = _order_cell_values(pedido_payload)
+    caminho_saida = _order_output_path(pedido_payload)
+    if engine == "xml":
+        _write_order_xml(cells, caminho_saida)
+    else:
+        _write_order_openpyxl(cells, caminho_saida)
+    return str(caminho_saida)
 
-    ws = wb[nome_aba]
-    try:
-        ws["AG2"] = pedido_payload["numero"]
-        ws["V6"] = pedido_payload["data"].day
-        ws["X6"] = pedido_payload["data"].month
-        ws["AG6"] = pedido_payload["data"].year
-        ws["G8"] = pedido_payload["fornecedor"]
-    except Exception as exc:
-        wb.close()
-        raise ValueError(f"Erro ao preencher campos do modelo: {exc}") from exc
-
-    linha_inicial = 15
-    for index, item in enumerate(pedido_payload["itens"]):
-        linha = linha_inicial + index
-        ws[f"A{linha}"] = item["quantidade"]
-        ws[f"F{linha}"] = item["prefixo"]
-        ws[f"J{linha}"] = item["codigo"]
-        ws[f"K{linha}"] = item["descricao"]
-        ws[f"X{linha}"] = item["valor_unitario"]
 
+def gerar_arquivo_pedido_aprovado_arquivo(pedido_payload):
+    inicio = time.perf_counter()
+    caminho = _write_order_file(pedido_payload, PLANILHA_ENGINE)
+    observar_metrica("pedidos_planilha_geracao_seconds", time.perf_counter() - inicio, engine=PLANILHA_ENGINE)
+    return caminho
+
+
+def _write_order_openpyxl(cells: dict, caminho_saida: Path) -> None:
+    snapshot, nome_aba = _load_modelo_template()
+    wb = pickle.loads(snapshot)
+    ws = wb[nome_aba]
+    for ref, value in cells.items():
+        ws[ref] = value
     wb.save(str(caminho_saida))
     wb.close()
-    return str(caminho_saida)
+
+
+# =====================================================
+# PLANILHA (ESCRITA DIRETA NO XML)
+# =====================================================
+# Trata o modelo como zip: as partes fixas sao preparadas uma vez por versao do
+# modelo e, por pedido, so a aba IMPRESSAO e o sharedStrings sao regravados.
+_XLSX_MAIN_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"
+_XLSM_MAIN_CONTENT_TYPE = "application/vnd.ms-excel.sheet.macroEnabled.main+xml"
+_ROW_RE = re.compile(r'<row\b[^>]*?\br="(\d+)"[^>]*?(?:/>|>.*?</row>)', re.S)
+_CELL_RE = re.compile(r'<c\b[^>]*?\br="([A-Z]+)\d+"[^>]*?(?:/>|>.*?</c>)', re.S)
+_CELL_ATTRS_RE = re.compile(r"<c\b([^>]*?)/?>")
+_ILLEGAL_XML_CHARS_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_modelo_xml_cache: dict = {"key": None, "template": None}
+
+
+def _zip_part_path(base: str, target: str) -> str:
+    if target.startswith("/"):
+        return target.lstrip("/")
+    parts = [p for p in base.split("/")[:-1] if p]
+    for piece in target.split("/"):
+        if piece == "..":
+            parts.pop()
+        elif piece and piece != ".":
+            parts.append(piece)
+    return "/".join(parts)
+
+
+def _load_modelo_xml_template() -> dict:
+    if not MODELO_PATH.exists():
+        raise FileNotFoundError(
+            "Modelo modelo_pedido.xlsm nao encontrado. Verifique o caminho configurado."
+        )
+    stat = MODELO_PATH.stat()
+    key = (str(MODELO_PATH), stat.st_mtime_ns, stat.st_size)
+    with _modelo_cache_lock:
+        if _modelo_xml_cache["key"] == key:
+            return _modelo_xml_cache["template"]
+        try:
+            with zipfile.ZipFile(MODELO_PATH) as zf:
+                parts = {info.filename: (info, zf.read(info.filename)) for info in zf.infolist()}
+        except PermissionError as exc:
+            raise ValueError("O modelo esta em uso. Feche o Excel e tente novamente.") from exc
+        template = _prepare_xml_template(parts)
+        _modelo_xml_cache.update(key=key, template=template)
+        logger.info("Modelo de pedido (xml) carregado em cache (%s)", MODELO_PATH.name)
+        return template
+
+
+def _prepare_xml_template(parts: dict) -> dict:
+    workbook_xml = parts["xl/workbook.xml"][1].decode("utf-8")
+    rels_xml = parts["xl/_rels/workbook.xml.rels"][1].decode("utf-8")
+
+    rel_targets = {}
+    vba_parts = set()
+    shared_strings_path = None
+    for rel in re.findall(r"<Relationship\b[^>]*/>", rels_xml):
+        rel_id = re.search(r'\bId="([^"]+)"', rel).group(1)
+        target = _zip_part_path("xl/workbook.xml", re.search(r'\bTarget="([^"]+)"', rel).group(1))
+        rel_targets[rel_id] = target
+        if rel.find("/vbaProject") != -1:
+            vba_parts.add(target)
+            rels_xml = rels_xml.replace(rel, "")
+        elif rel.find("/sharedStrings") != -1:
+            shared_strings_path = target
+
+    sheet_path = None
+    for sheet in re.findall(r"<sheet\b[^>]*/>", workbook_xml):
+        nome = re.search(r'\bname="([^"]+)"', sheet).group(1)
+        if "IMPRESSAO" in nome.upper():
+            sheet_path = rel_targets.get(re.search(r'\br:id="([^"]+)"', sheet).group(1))
+            break
+    if not sheet_path or sheet_path not in parts:
+        raise ValueError("Aba de impressao nao encontrada no modelo.")
+
+    # recalcula formulas ao abrir (os valores em cache do modelo ficam obsoletos)
+    if "fullCalcOnLoad" not in workbook_xml:
+        if "<calcPr" in workbook_xml:
+            workbook_xml = workbook_xml.replace("<calcPr", '<calcPr fullCalcOnLoad="1"', 1)
+        else:
+            workbook_xml = workbook_xml.replace("</workbook>", '<calcPr fullCalcOnLoad="1"/></workbook>')
+
+    content_types = parts["[Content_Types].xml"][1].decode("utf-8")
+    content_types = content_types.replace(_XLSM_MAIN_CONTENT_TYPE, _XLSX_MAIN_CONTENT_TYPE)
+    if shared_strings_path is None:
+        shared_strings_path = "xl/sharedStrings.xml"
+        rels_xml = rels_xml.replace(
+            "</Relationships>",
+            '<Relationship Id="rIdPedidosSst" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+            'Target="sharedStrings.xml"/></Relationships>',
+        )
+        content_types = content_types.replace(
+            "</Types>",
+            '<Override PartName="/xl/sharedStrings.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>',
+        )
+    for vba_part in vba_parts:
+        content_types = re.sub(rf'<Override\b[^>]*PartName="/{re.escape(vba_part)}"[^>]*/>', "", content_types)
+
+    static_parts = {}
+    for name, (info, data) in parts.items():
+        if name in vba_parts or name in (sheet_path, shared_strings_path):
+            continue
+        if name == "[Content_Types].xml":
+            data = content_types.encode("utf-8")
+        elif name == "xl/workbook.xml":
+            data = workbook_xml.encode("utf-8")
+        elif name == "xl/_rels/workbook.xml.rels":
+            data = rels_xml.encode("utf-8")
+        static_parts[name] = data
+
+    sheet_xml = parts[sheet_path][1].decode("utf-8")
+    data_start = sheet_xml.index("<sheetData")
+    data_open_end = sheet_xml.index(">", data_start) + 1
+    if sheet_xml[data_open_end - 2] == "/":
+        head = sheet_xml[:data_start] + "<sheetData>"
+        body = ""
+        tail = "</sheetData>" + sheet_xml[data_open_end:]
+    else:
+        data_close = sheet_xml.index("</sheetData>", data_open_end)
+        head = sheet_xml[:data_open_end]
+        body = sheet_xml[data_open_end:data_close]
+        tail = sheet_xml[data_close:]
+    rows = [(int(m.group(1)), m.group(0)) for m in _ROW_RE.finditer(body)]
+
+    sst_xml = None
+    sst_count = sst_unique = 0
+    if shared_strings_path and shared_strings_path in parts:
+        sst_xml = parts[shared_strings_path][1].decode("utf-8")
+        count_match = re.search(r'<sst\b[^>]*?\bcount="(\d+)"', sst_xml)
+        unique_match = re.search(r'<sst\b[^>]*?\buniqueCount="(\d+)"', sst_xml)
+        sst_unique = int(unique_match.group(1)) if unique_match else sst_xml.count("<si>") + sst_xml.count("<si ")
+        sst_count = int(count_match.group(1)) if count_match else sst_unique
+
+    return {
+        "order": [name for name in parts if name not in vba_parts],
+        "static": static_parts,
+        "sheet_path": sheet_path,
+        "sheet_head": head,
+        "sheet_rows": rows,
+        "sheet_tail": tail,
+        "sst_path": shared_strings_path,
+        "sst_xml": sst_xml,
+        "sst_count": sst_count,
+        "sst_unique": sst_unique,
+    }
+
+
+def _xml_cell(ref: str, attrs: str, value, shared_strings: list[str], base_index: int) -> str:
+    attrs = re.sub(r'\s+(?:r|t)="[^"]*"', "", attrs)
+    if value is None or value == "":
+        return f'<c r="{ref}"{attrs}/>'
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{attrs} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c r="{ref}"{attrs}><v>{value}</v></c>'
+    shared_strings.append(_ILLEGAL_XML_CHARS_RE.sub("", str(value)))
+    return f'<c r="{ref}"{attrs} t="s"><v>{base_index + len(shared_strings) - 1}</v></c>'
+
+
+def _patch_row(row_number: int, row_xml: str | None, values: dict, shared_strings: list[str], base_index: int) -> str:
+    """Substitui/insere as celulas de `values` ({coluna: valor}) numa linha da aba."""
+    pending = sorted((column_index_from_string(col), col, value) for col, value in values.items())
+    if row_xml is None:
+        open_tag, cells_xml, close_tag = f'<row r="{row_number}">', "", "</row>"
+    elif row_xml.endswith("/>") and "</row>" not in row_xml:
+        open_tag, cells_xml, close_tag = row_xml[:-2] + ">", "", "</row>"
+    else:
+        open_end = row_xml.index(">") + 1
+        open_tag, cells_xml, close_tag = row_xml[:open_end], row_xml[open_end:-len("</row>")], "</row>"
+
+    out = []
+    position = 0
+    for match in _CELL_RE.finditer(cells_xml):
+        col_idx = column_index_from_string(match.group(1))
+        out.append(cells_xml[position : match.start()])
+        while pending and pending[0][0] < col_idx:
+            _, col, value = pending.pop(0)
+            out.append(_xml_cell(f"{col}{row_number}", "", value, shared_strings, base_index))
+        if pending and pending[0][0] == col_idx:
+            _, col, value = pending.pop(0)
+            attrs = _CELL_ATTRS_RE.match(match.group(0)).group(1)
+            out.append(_xml_cell(f"{col}{row_number}", attrs, value, shared_strings, base_index))
+        else:
+            out.append(match.group(0))
+        position = match.end()
+    out.append(cells_xml[position:])
+    for _, col, value in pending:
+        out.append(_xml_cell(f"{col}{row_number}", "", value, shared_strings, base_index))
+    return open_tag + "".join(out) + close_tag
+
+
+def _iter_patched_sheet(template: dict, cells: dict, shared_strings: list[str]):
+    por_linha: dict[int, dict] = {}
+    for ref, value in cells.items():
+        col, row = coordinate_from_string(ref)
+        por_linha.setdefault(row, {})[col] = value
+    base_index = template["sst_unique"]
+    pendentes = sorted(por_linha)
+
+    yield template["sheet_head"]
+    for row_number, row_xml in template["sheet_rows"]:
+        while pendentes and pendentes[0] < row_number:
+            novo = pendentes.pop(0)
+            yield _patch_row(novo, None, por_linha[novo], shared_strings, base_index)
+        if pendentes and pendentes[0] == row_number:
+            pendentes.pop(0)
+            yield _patch_row(row_number, row_xml, por_linha[row_number], shared_strings, base_index)
+        else:
+            yield row_xml
+    for novo in pendentes:
+        yield _patch_row(novo, None, por_linha[novo], shared_strings, base_index)
+    yield template["sheet_tail"]
+
+
+def _shared_strings_xml(template: dict, shared_strings: list[str]) -> str:
+    novos = "".join(
+        f'<si><t xml:space="preserve">{xml_escape(value)}</t></si>' for value in shared_strings
+    )
+    count = template["sst_count"] + len(shared_strings)
+    unique = template["sst_unique"] + len(shared_strings)
+    sst_xml = template["sst_xml"]
+    if sst_xml is None:
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'count="{count}" uniqueCount="{unique}">{novos}</sst>'
+        )
+    sst_xml = re.sub(r'(<sst\b[^>]*?\bcount=")\d+"', rf'\g<1>{count}"', sst_xml, count=1)
+    sst_xml = re.sub(r'(<sst\b[^>]*?\buniqueCount=")\d+"', rf'\g<1>{unique}"', sst_xml, count=1)
+    if sst_xml.rstrip().endswith("/>"):
+        return sst_xml.rstrip()[:-2] + f">{novos}</sst>"
+    return sst_xml.replace("</sst>", f"{novos}</sst>")
+
+
+def _write_order_xml(cells: dict, caminho_saida: Path) -> None:
+    template = _load_modelo_xml_template()
+    shared_strings: list[str] = []
+    tmp_path = caminho_saida.with_suffix(caminho_saida.suffix + ".tmp")
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as out:
+        for name in template["order"]:
+            if name == template["sheet_path"]:
+                with out.open(name, "w") as handle:
+                    for chunk in _iter_patched_sheet(template, cells, shared_strings):
+                        handle.write(chunk.encode("utf-8"))
+            elif name != template["sst_path"]:
+                out.writestr(name, template["static"][name])
+        # sharedStrings por ultimo: so fica completo depois de percorrer a aba
+        out.writestr(template["sst_path"], _shared_strings_xml(template, shared_strings))
+    os.replace(tmp_path, caminho_saida)
 
 
 def resolve_pedido_excel_path(arquivo_excel: str | None):
@@ -914,6 +2817,373 @@ def resolve_pedido_excel_path(arquivo_excel: str | None):
     return str((PASTA_PEDIDOS_APROVADOS / filename).resolve())
 
 
+# =====================================================
+# JOBS (FILA EM SEGUNDO PLANO)
+# =====================================================
+JOB_PENDENTE = "pendente"
+JOB_EXECUTANDO = "executando"
+JOB_CONCLUIDO = "concluido"
+JOB_ERRO = "erro"
+
+_job_executor: ThreadPoolExecutor | None = None
+_job_executor_lock = threading.Lock()
+
+
+def _job_gerar_planilha(job: Job) -> str:
+    caminho = generate_order_file(job.pedido_id)
+    return Path(caminho).name
+
+
+def _job_retencao(job: Job) -> str:
+    relatorio = run_retention()
+    return json.dumps(relatorio)
+
+
+def last_retention_summary() -> dict | None:
+    """Resultado da ultima retencao concluida (job gravado no banco).
+
+    Vale para qualquer worker, ao contrario de um valor guardado em memoria
+    pelo processo que executou a retencao.
+    """
+    job = (
+        db.session.query(Job.resultado, Job.finished_at)
+        .filter(Job.tipo == "retencao", Job.status == JOB_CONCLUIDO)
+        .order_by(Job.finished_at.desc())
+        .first()
+    )
+    if job is None or not job.resultado:
+        return None
+    try:
+        relatorio = json.loads(job.resultado)
+    except ValueError:
+        return None
+    return {
+        "pedidos": relatorio.get("pedidos", 0),
+        "em": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+_JOB_HANDLERS = {
+    "gerar_planilha": _job_gerar_planilha,
+    "retencao": _job_retencao,
+}
+
+
+def _get_job_executor() -> ThreadPoolExecutor:
+    # criado sob demanda: com gunicorn cada worker (pos-fork) tem o seu
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(
+                max_workers=max(1, JOB_WORKERS), thread_name_prefix="pedidos-job"
+            )
+        return _job_executor
+
+
+def _submit_job(job_id: int) -> None:
+    if JOB_WORKERS <= 0:
+        _run_job(job_id)
+        return
+    _get_job_executor().submit(_run_in_app_context, _run_job, job_id)
+
+
+def _run_in_app_context(func, *args) -> None:
+    with app.app_context():
+        try:
+            func(*args)
+        finally:
+            db.session.remove()
+
+
+def _run_job(job_id: int) -> None:
+    # reserva atomica: so um worker/thread executa cada job
+    claimed = (
+        db.session.query(Job)
+        .filter(Job.id == job_id, Job.status == JOB_PENDENTE)
+        .update(
+            {
+                Job.status: JOB_EXECUTANDO,
+                Job.started_at: datetime.utcnow(),
+                Job.tentativas: Job.tentativas + 1,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.session.commit()
+    if not claimed:
+        return
+
+    job = db.session.get(Job, job_id)
+    handler = _JOB_HANDLERS.get(job.tipo)
+    try:
+        if handler is None:
+            raise ValueError(f"Tipo de job desconhecido: {job.tipo}")
+        resultado = handler(job)
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception("Job %s (%s) falhou", job_id, job.tipo)
+        job = db.session.get(Job, job_id)
+        job.status = JOB_ERRO
+        job.erro = str(exc) or exc.__class__.__name__
+    else:
+        job.status = JOB_CONCLUIDO
+        job.resultado = resultado
+        job.erro = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def enqueue_job(tipo: str, pedido_id: int | None = None, created_by: str | None = None) -> int:
+    if tipo not in _JOB_HANDLERS:
+        raise ValueError(f"Tipo de job desconhecido: {tipo}")
+    job = Job(tipo=tipo, pedido_id=pedido_id, status=JOB_PENDENTE, created_by=created_by)
+    db.session.add(job)
+    db.session.commit()
+    _submit_job(job.id)
+    return job.id
+
+
+def _claim_schedule(nome: str, intervalo: timedelta) -> bool:
+    """Reivindica a execucao de `nome` se a ultima foi ha mais de `intervalo`.
+
+    Atomico entre workers: o UPDATE condicional (ou o INSERT da primeira vez,
+    pela chave primaria) so tem efeito para um deles. A reivindicacao fica
+    pendente na sessao e e gravada junto com o job.
+    """
+    agora = datetime.utcnow()
+    tabela = Agendamento.__table__
+    result = db.session.execute(
+        tabela.update()
+        .where(tabela.c.nome == nome, tabela.c.executado_em < agora - intervalo)
+        .values(executado_em=agora)
+    )
+    if result.rowcount:
+        return True
+    if db.session.get(Agendamento, nome) is not None:
+        db.session.rollback()
+        return False
+    # primeira vez: parte do ultimo job criado antes do agendamento existir
+    ultimo = db.session.query(db.func.max(Job.created_at)).filter(Job.tipo == nome).scalar()
+    devido = ultimo is None or ultimo < agora - intervalo
+    db.session.add(Agendamento(nome=nome, executado_em=agora if devido else ultimo))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # outro worker criou ao mesmo tempo
+        db.session.rollback()
+        return False
+    if not devido:
+        db.session.commit()
+    return devido
+
+
+def schedule_retention_if_due() -> int | None:
+    """Enfileira a retencao se nenhuma foi reivindicada dentro do intervalo configurado."""
+    if not _claim_schedule("retencao", timedelta(hours=RETENCAO_INTERVALO_HORAS)):
+        return None
+    return enqueue_job("retencao")
+
+
+def _retention_scheduler_loop() -> None:
+    intervalo = RETENCAO_INTERVALO_HORAS * 3600
+    while True:
+        try:
+            _run_in_app_context(schedule_retention_if_due)
+        except Exception:
+            logger.exception("Erro ao agendar retencao")
+        time.sleep(min(intervalo, 3600))
+
+
+_retention_thread: threading.Thread | None = None
+
+
+def start_retention_scheduler() -> None:
+    global _retention_thread
+    if RETENCAO_INTERVALO_HORAS <= 0 or JOB_WORKERS <= 0 or _retention_thread is not None:
+        return
+    _retention_thread = threading.Thread(
+        target=_retention_scheduler_loop, name="pedidos-retencao", daemon=True
+    )
+    _retention_thread.start()
+
+
+def resume_pending_jobs() -> int:
+    """Reenfileira jobs pendentes e devolve a fila os que ficaram presos executando."""
+    stale_before = datetime.utcnow() - JOB_STALE_AFTER
+    try:
+        db.session.query(Job).filter(
+            Job.status == JOB_EXECUTANDO, Job.started_at < stale_before
+        ).update({Job.status: JOB_PENDENTE}, synchronize_session=False)
+        db.session.commit()
+        job_ids = [
+            job_id
+            for (job_id,) in db.session.query(Job.id)
+            .filter(Job.status == JOB_PENDENTE)
+            .order_by(Job.created_at)
+            .all()
+        ]
+    except Exception:
+        db.session.rollback()
+        logger.exception("Erro ao retomar jobs pendentes")
+        return 0
+    for job_id in job_ids:
+        _submit_job(job_id)
+    if job_ids:
+        logger.info("Retomados %s jobs pendentes", len(job_ids))
+    return len(job_ids)
+
+
+def serialize_job(job: Job) -> dict:
+    data = {
+        "id": job.id,
+        "tipo": job.tipo,
+        "pedido_id": job.pedido_id,
+        "status": job.status,
+        "erro": job.erro,
+        "tentativas": job.tentativas,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "download_url": None,
+    }
+    if job.status == JOB_CONCLUIDO and job.tipo == "gerar_planilha" and job.pedido_id:
+        data["download_url"] = url_for("download_pedido", pedido_id=job.pedido_id)
+    return data
+
+
+# =====================================================
+# EVENTOS (SSE)
+# =====================================================
+# Os eventos sao linhas da tabela `eventos`, gravadas na mesma transacao da
+# alteracao; cada conexao SSE le a tabela a partir do ultimo id enviado, o que
+# vale para qualquer worker. No PostgreSQL um LISTEN acorda a conexao assim que
+# o commit acontece; no SQLite a tabela e consultada a cada EVENTOS_POLL.
+def latest_event_id() -> int:
+    return db.session.query(db.func.max(Evento.id)).scalar() or 0
+
+
+def _fetch_events(after_id: int, lacunas=(), limit: int = 200) -> list:
+    tabela = Evento.__table__
+    condicao = tabela.c.id > after_id
+    if lacunas:
+        condicao = or_(condicao, tabela.c.id.in_(list(lacunas)))
+    with db.engine.connect() as conn:
+        return conn.execute(
+            db.select(tabela).where(condicao).order_by(tabela.c.id).limit(limit)
+        ).all()
+
+
+def _open_event_listener():
+    if not _is_postgres():
+        return None
+    try:
+        raw = db.engine.raw_connection()
+        conexao = raw.driver_connection
+        conexao.autocommit = True
+        with conexao.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVENTOS_CANAL}")
+        return raw
+    except Exception:
+        logger.warning("LISTEN indisponivel; eventos por consulta periodica")
+        return None
+
+
+def _close_event_listener(raw) -> None:
+    if raw is None:
+        return
+    try:
+        conexao = raw.driver_connection
+        with conexao.cursor() as cursor:
+            cursor.execute("UNLISTEN *")
+        conexao.autocommit = False
+    finally:
+        raw.close()
+
+
+def _wait_for_events(listener, timeout: float) -> None:
+    if listener is None:
+        time.sleep(timeout)
+        return
+    conexao = listener.driver_connection
+    if select.select([conexao], [], [], timeout)[0]:
+        conexao.poll()
+        conexao.notifies.clear()
+
+
+def _format_sse(row, cursor: int) -> str:
+    data = {
+        "id": row.id,
+        "pedido_id": row.pedido_id,
+        "status": row.status,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+    # `id` do SSE e o maior id ja enviado (Last-Event-ID nunca volta)
+    return f"id: {cursor}\nevent: {row.tipo}\ndata: {json.dumps(data)}\n\n"
+
+
+def _register_event_gaps(lacunas: dict, after_id: int, novo_id: int) -> None:
+    """Anota os ids entre `after_id` e `novo_id` que ainda nao apareceram.
+
+    No PostgreSQL o id vem da sequencia no INSERT, nao no commit: uma
+    transacao mais lenta pode gravar um id menor depois de um maior ja lido.
+    """
+    prazo = time.monotonic() + EVENTOS_LACUNA_SEGUNDOS
+    for faltante in range(after_id + 1, novo_id):
+        if len(lacunas) >= EVENTOS_LACUNAS_MAX:
+            break
+        lacunas[faltante] = prazo
+
+
+_eventos_conexoes = threading.BoundedSemaphore(max(EVENTOS_CONEXOES_MAX, 1))
+
+
+def reserve_event_stream():
+    """Reserva uma vaga de conexao SSE; devolve a funcao que a libera ou None."""
+    if EVENTOS_CONEXOES_MAX <= 0 or not _eventos_conexoes.acquire(blocking=False):
+        return None
+    liberada = threading.Event()
+
+    def liberar() -> None:
+        if not liberada.is_set():
+            liberada.set()
+            _eventos_conexoes.release()
+
+    return liberar
+
+
+def stream_order_events(after_id: int, duracao: float = EVENTOS_CONEXAO_MAX):
+    """Gera o fluxo SSE a partir de `after_id` ate `duracao` segundos."""
+    listener = _open_event_listener()
+    espera = EVENTOS_HEARTBEAT if listener is not None else EVENTOS_POLL
+    try:
+        yield "retry: 3000\n\n"
+        fim = time.monotonic() + duracao
+        ultimo_envio = time.monotonic()
+        lacunas: dict[int, float] = {}
+        while time.monotonic() < fim:
+            agora = time.monotonic()
+            for vencida in [eid for eid, prazo in lacunas.items() if prazo < agora]:
+                del lacunas[vencida]
+            eventos = _fetch_events(after_id, lacunas)
+            for row in eventos:
+                if row.id > after_id:
+                    _register_event_gaps(lacunas, after_id, row.id)
+                    after_id = row.id
+                else:
+                    lacunas.pop(row.id, None)
+                yield _format_sse(row, after_id)
+            if eventos:
+                ultimo_envio = time.monotonic()
+                continue
+            if time.monotonic() - ultimo_envio >= EVENTOS_HEARTBEAT:
+                # comentario SSE: mantem proxies e o navegador com a conexao aberta
+                yield ": ping\n\n"
+                ultimo_envio = time.monotonic()
+            _wait_for_events(listener, min(espera, max(fim - time.monotonic(), 0)))
+    finally:
+        _close_event_listener(listener)
+
+
 # =====================================================
 # ROTAS / VIEWS
 # =====================================================
@@ -975,7 +3245,12 @@ def gerar_automatico():
         flash(f"Erro ao gerar pedidos automáticos: {exc}", "error")
     else:
         created = result.get("created", 0)
-        if created:
+        if result.get("unchanged"):
+            flash(
+                f"{result['workbook'].name} não foi alterada desde a última importação.",
+                "info",
+            )
+        elif created:
             flash(
                 f"{created} pedidos automáticos foram gerados a partir de {result['workbook'].name}.",
                 "success",
@@ -1001,7 +3276,7 @@ def api_context():
         "user": user,
         "suppliers": list_suppliers(),
         "statuses": ["Pendente", "Aprovado", "Gerado"],
-        "purged_on_start": PURGED_ON_START,
+        "ultima_retencao": last_retention_summary(),
         "modelo_disponivel": MODELO_PATH.exists(),
     }
     if user and user.get("role") == "admin":
@@ -1024,14 +3299,73 @@ def api_fornecedores():
     return jsonify({"suppliers": list_suppliers()})
 
 
+def _order_filters_from_request() -> dict:
+    return {
+        "fornecedor": (request.args.get("fornecedor") or "").strip() or None,
+        "status": (request.args.get("status") or "").strip() or None,
+        "desde": parse_filter_date(request.args.get("desde")),
+        "ate": parse_filter_date(request.args.get("ate"), end_of_day=True),
+        "created_by": (request.args.get("created_by") or "").strip() or None,
+    }
+
+
+def _with_etag(response, etag: str):
+    response.set_etag(etag)
+    # o navegador revalida a cada fetch e reaproveita o corpo no 304
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Cookie")
+    return response
+
+
+def _conditional_json(etag: str, build):
+    """Responde 304 se o cliente ja tem a versao `etag`; senao serializa `build()`."""
+    if request.if_none_match.contains_weak(etag):
+        return _with_etag(app.response_class(status=304), etag)
+    return _with_etag(jsonify(build()), etag)
+
+
+def _listing_etag() -> str:
+    # a listagem depende apenas do contador global e dos parametros da consulta
+    chave = f"{current_orders_version()}?{request.query_string.decode('latin-1')}"
+    return "l-" + hashlib.sha1(chave.encode("utf-8")).hexdigest()
+
+
 @app.route("/api/pedidos", methods=["GET", "POST"])
 @api_login_required
 def api_pedidos():
     if request.method == "GET":
-        fornecedor = (request.args.get("fornecedor") or "").strip()
-        status = (request.args.get("status") or "").strip()
-        pedidos = list_orders(fornecedor or None, status or None)
-        return jsonify({"pedidos": pedidos})
+        try:
+            filtros = _order_filters_from_request()
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        since_raw = (request.args.get("since") or "").strip()
+        if since_raw:
+            try:
+                since = parse_filter_date(since_raw)
+            except ValueError as exc:
+                return jsonify({"error": str(exc)}), 400
+            return jsonify(list_orders_changes(since, **filtros))
+        limit_raw = (request.args.get("limit") or "").strip()
+        cursor = (request.args.get("cursor") or "").strip()
+        if limit_raw or cursor:
+            try:
+                limit = int(limit_raw) if limit_raw else LIST_ORDERS_DEFAULT_LIMIT
+            except ValueError:
+                return jsonify({"error": "Parametro limit invalido"}), 400
+            if cursor:
+                # valida antes do ETag; a pagina so e consultada se nao houver 304
+                try:
+                    decode_orders_cursor(cursor)
+                except ValueError as exc:
+                    return jsonify({"error": str(exc)}), 400
+            # versao lida antes dos dados: uma escrita no meio gera ETag antigo,
+            # nunca dados antigos com ETag novo
+            etag = _listing_etag()
+            return _conditional_json(
+                etag, lambda: list_orders_page(**filtros, limit=limit, cursor=cursor or None)
+            )
+        etag = _listing_etag()
+        return _conditional_json(etag, lambda: {"pedidos": list_orders(**filtros)})
 
     payload = request.get_json(silent=True) or {}
     fornecedor = payload.get("fornecedor")
@@ -1050,14 +3384,54 @@ def api_pedidos():
     return jsonify({"pedido_id": pedido_id})
 
 
+@app.route("/api/pedidos/resumo")
+@api_login_required
+def api_pedidos_resumo():
+    try:
+        filtros = _order_filters_from_request()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return _conditional_json(_listing_etag(), lambda: summarize_orders(**filtros))
+
+
+@app.route("/api/pedidos/export")
+@api_login_required
+def api_pedidos_export():
+    formato = (request.args.get("format") or "csv").strip().lower()
+    if formato not in {"csv", "xlsx"}:
+        return jsonify({"error": "Formato invalido (use csv ou xlsx)"}), 400
+    try:
+        filtros = _order_filters_from_request()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    nome_arquivo = f"pedidos_{datetime.now():%Y%m%d_%H%M%S}.{formato}"
+    if formato == "csv":
+        gerador = export_orders_csv(**filtros)
+        mimetype = "text/csv; charset=utf-8"
+    else:
+        gerador = export_orders_xlsx(**filtros)
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    response = app.response_class(stream_with_context(gerador), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{nome_arquivo}"'
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/api/pedidos/<int:pedido_id>", methods=["GET", "PUT"])
 @api_login_required
 def api_pedido_detalhe(pedido_id):
     if request.method == "GET":
+        # so a linha do pedido (PK) e consultada para decidir o 304
+        versao = db.session.query(Pedido.versao).filter(Pedido.id == pedido_id).first()
+        if versao is None:
+            return jsonify({"error": "Pedido nao encontrado"}), 404
+        etag = f"p{pedido_id}-v{versao[0] or 0}"
+        if request.if_none_match.contains_weak(etag):
+            return _with_etag(app.response_class(status=304), etag)
         pedido = get_order(pedido_id)
         if not pedido:
             return jsonify({"error": "Pedido nao encontrado"}), 404
-        return jsonify({"pedido": pedido})
+        return _with_etag(jsonify({"pedido": pedido}), etag)
 
     payload = request.get_json(silent=True) or {}
     itens = payload.get("itens") or []
@@ -1072,6 +3446,25 @@ def api_pedido_detalhe(pedido_id):
     return jsonify({"pedido": pedido})
 
 
+@app.route("/api/pedidos/<int:pedido_id>/itens", methods=["PATCH"])
+@api_login_required
+def api_pedido_itens(pedido_id):
+    payload = request.get_json(silent=True) or {}
+    try:
+        patch_pending_order_items(
+            pedido_id,
+            adicionar=payload.get("adicionar"),
+            alterar=payload.get("alterar"),
+            remover=payload.get("remover"),
+        )
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except Exception:
+        traceback.print_exc()
+        return jsonify({"error": "Falha ao atualizar itens"}), 500
+    return jsonify({"pedido": get_order(pedido_id)})
+
+
 @app.route("/api/pedidos/<int:pedido_id>/approve", methods=["POST"])
 @roles_required("approver", "admin")
 def api_pedido_approve(pedido_id):
@@ -1083,29 +3476,114 @@ def api_pedido_approve(pedido_id):
         traceback.print_exc()
         return jsonify({"error": "Falha ao aprovar pedido"}), 500
 
-    download_url = None
     try:
-        caminho = generate_order_file(pedido_id)
-        download_url = url_for("download_pedido", pedido_id=pedido_id)
+        job_id = enqueue_job("gerar_planilha", pedido_id, current_user().get("username"))
     except Exception as exc:
         traceback.print_exc()
         return jsonify(
             {
-                "warning": "Pedido aprovado, mas houve erro ao gerar arquivo automaticamente.",
+                "warning": "Pedido aprovado, mas houve erro ao agendar a geracao do arquivo.",
                 "detail": str(exc),
             }
         )
 
+    job = db.session.get(Job, job_id)
     pedido = get_order(pedido_id)
-    return jsonify(
-        {
-            "pedido": pedido,
-            "download_url": download_url,
-            "caminho": caminho,
-        }
+    return (
+        jsonify(
+            {
+                "pedido": pedido,
+                "job": serialize_job(job),
+                "job_url": url_for("api_job", job_id=job_id),
+            }
+        ),
+        202,
     )
 
 
+@app.route("/api/pedidos/approve", methods=["POST"])
+@roles_required("approver", "admin")
+def api_pedidos_approve_lote():
+    payload = request.get_json(silent=True) or {}
+    raw_ids = payload.get("ids") or payload.get("pedidos") or []
+    try:
+        order_ids = list(dict.fromkeys(int(value) for value in raw_ids))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Lista de pedidos invalida"}), 400
+    if not order_ids:
+        return jsonify({"error": "Informe os pedidos a aprovar"}), 400
+    if len(order_ids) > APROVACAO_LOTE_MAX:
+        return jsonify({"error": f"Maximo de {APROVACAO_LOTE_MAX} pedidos por lote"}), 400
+
+    try:
+        aprovados, erros = approve_orders(order_ids, current_user().get("username"))
+    except Exception:
+        traceback.print_exc()
+        return jsonify({"error": "Falha ao aprovar pedidos"}), 500
+
+    gerados: dict = {}
+    if aprovados:
+        try:
+            gerados = generate_order_files(aprovados)
+        except Exception as exc:
+            traceback.print_exc()
+            gerados = {order_id: exc for order_id in aprovados}
+
+    resultados = []
+    for order_id in order_ids:
+        if order_id in erros:
+            resultados.append({"id": order_id, "aprovado": False, "error": erros[order_id]})
+            continue
+        resultado = gerados.get(order_id)
+        item = {"id": order_id, "aprovado": True, "download_url": None}
+        if isinstance(resultado, str):
+            item["download_url"] = url_for("download_pedido", pedido_id=order_id)
+        else:
+            item["warning"] = "Pedido aprovado, mas houve erro ao gerar arquivo automaticamente."
+            item["detail"] = str(resultado)
+        resultados.append(item)
+    return jsonify({"resultados": resultados, "aprovados": len(aprovados)})
+
+
+@app.route("/api/jobs/<int:job_id>")
+@api_login_required
+def api_job(job_id):
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({"error": "Job nao encontrado"}), 404
+    return jsonify({"job": serialize_job(job)})
+
+
+@app.route("/api/eventos")
+@api_login_required
+def api_eventos():
+    # EventSource reenvia o ultimo id recebido ao reconectar
+    ultimo = (request.headers.get("Last-Event-ID") or request.args.get("ultimo") or "").strip()
+    try:
+        after_id = int(ultimo) if ultimo else latest_event_id()
+    except ValueError:
+        return jsonify({"error": "Parametro ultimo invalido"}), 400
+    liberar = reserve_event_stream()
+    if liberar is None:
+        # sem vaga: o navegador cai para a consulta periodica e tenta de novo depois
+        incrementar_metrica("pedidos_eventos_recusados_total")
+        response = jsonify({"error": "Limite de conexoes de eventos atingido"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(int(EVENTOS_CONEXAO_MAX))
+        return response
+    # a conexao do banco usada no inicio nao deve ficar presa durante o fluxo
+    db.session.remove()
+    response = app.response_class(
+        stream_with_context(stream_order_events(after_id)),
+        mimetype="text/event-stream",
+    )
+    # chamado pelo servidor ao fechar a resposta, mesmo se o fluxo nao comecou
+    response.call_on_close(liberar)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/api/pedidos/<int:pedido_id>/generate", methods=["POST"])
 @api_login_required
 def api_pedido_generate(pedido_id):
@@ -1181,6 +3659,23 @@ def api_users_delete(username):
     return jsonify({"users": list_users()})
 
 
+@app.route("/api/profiles")
+@roles_required("admin")
+def api_profiles():
+    return jsonify({"profiles": list_profiles()})
+
+
+@app.route("/api/profiles/<nome>")
+@roles_required("admin")
+def api_profile_download(nome):
+    caminho = resolve_profile_path(nome)
+    if caminho is None:
+        return jsonify({"error": "Profile nao encontrado"}), 404
+    if (request.args.get("formato") or "").strip().lower() == "texto":
+        return app.response_class(profile_summary(caminho), mimetype="text/plain")
+    return send_file(caminho, as_attachment=True, download_name=caminho.name)
+
+
 @app.route("/api/me/password", methods=["POST"])
 @api_login_required
 def api_me_password():
@@ -1199,32 +3694,244 @@ def api_me_password():
 def health():
     try:
         db.session.execute(text("SELECT 1"))
-        return jsonify({"status": "ok"})
+        return jsonify({"status": "ok", "geracao_cache": generation_cache_stats()})
     except Exception:
         traceback.print_exc()
         return jsonify({"status": "error"}), 500
 
 
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Nao autorizado"}), 401
+    return app.response_class(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 # =====================================================
-# INIT
+# ESQUEMA (ajustes idempotentes alem do create_all)
 # =====================================================
-PURGED_ON_START = 0
+def _ensure_columns(model, column_names) -> None:
+    table = model.__table__
+    existing = {col["name"] for col in inspect(db.engine).get_columns(table.name)}
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.columns[name]
+        ddl_type = column.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {ddl_type}'))
+        logger.info("Coluna %s.%s adicionada", table.name, name)
+
+
+def _ensure_indexes(model) -> None:
+    for index in model.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+def _drop_obsolete_indexes() -> None:
+    # a busca por fornecedor e por trecho: o indice simples da coluna normalizada nao e usado
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_pedidos_fornecedor_busca"))
+
+
+def _ensure_trigram_index() -> None:
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_pedidos_fornecedor_trgm "
+                    "ON pedidos USING gin (fornecedor gin_trgm_ops)"
+                )
+            )
+    except Exception:
+        logger.warning("Nao foi possivel criar indice pg_trgm; busca por fornecedor sem indice")
+
+
+def _backfill_normalized(model, source: str, target: str, batch_size: int = 1000) -> None:
+    """Preenche em lotes a coluna normalizada `target` a partir de `source`."""
+    table = model.__table__
+    while True:
+        rows = (
+            db.session.query(table.c.id, table.c[source])
+            .filter(table.c[target].is_(None))
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam("pid"))
+            .values({target: bindparam("normalizado")}),
+            [{"pid": row[0], "normalizado": normalize_search_text(row[1])} for row in rows],
+        )
+        db.session.commit()
+
+
+def _backfill_order_totals() -> None:
+    """Calcula total_valor/item_count dos pedidos anteriores as colunas (uma vez)."""
+    itens = PedidoItem.__table__
+    total = (
+        db.select(db.func.coalesce(db.func.sum(itens.c.valor * itens.c.quantidade), 0))
+        .where(itens.c.pedido_id == Pedido.__table__.c.id)
+        .scalar_subquery()
+    )
+    count = (
+        db.select(db.func.count(itens.c.id))
+        .where(itens.c.pedido_id == Pedido.__table__.c.id)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        Pedido.__table__.update()
+        .where(Pedido.__table__.c.item_count.is_(None))
+        .values(total_valor=total, item_count=count)
+    )
+    db.session.commit()
+    if result.rowcount:
+        logger.info("Totais calculados para %s pedidos existentes", result.rowcount)
+
+
+def _backfill_updated_at() -> None:
+    tabela = Pedido.__table__
+    db.session.execute(
+        tabela.update().where(tabela.c.updated_at.is_(None)).values(updated_at=tabela.c.created_at)
+    )
+    db.session.commit()
+
+
+def _migrate_lc_fingerprints() -> None:
+    """Recria lc_importacao_linhas com chave (importacao_id, linha).
+
+    As linhas antigas nao indicavam a planilha; ficam com a importacao mais
+    recente, a unica que as gravou desde a ultima troca de PEDIDOS_LC_PATH.
+    """
+    tabela = ImportacaoLCLinha.__table__
+    colunas = {col["name"] for col in inspect(db.engine).get_columns(tabela.name)}
+    if "importacao_id" in colunas:
+        return
+    with db.engine.begin() as conn:
+        linhas = conn.execute(text(f"SELECT linha, fingerprint, pedido_id FROM {tabela.name}")).all()
+        ultima = conn.execute(
+            db.select(ImportacaoLC.__table__.c.id)
+            .order_by(ImportacaoLC.__table__.c.importado_em.desc())
+            .limit(1)
+        ).scalar()
+        conn.execute(text(f"DROP TABLE {tabela.name}"))
+        tabela.create(conn)
+        if linhas and ultima is not None:
+            conn.execute(
+                tabela.insert(),
+                [
+                    {"importacao_id": ultima, "linha": linha, "fingerprint": fingerprint, "pedido_id": pedido_id}
+                    for linha, fingerprint, pedido_id in linhas
+                ],
+            )
+    logger.info("lc_importacao_linhas migrada para chave por planilha (%s linhas)", len(linhas))
+
+
+def _ensure_cache_versions() -> None:
+    existentes = {nome for (nome,) in db.session.query(CacheVersao.nome).all()}
+    faltantes = [nome for nome in CACHE_NOMES if nome not in existentes]
+    if not faltantes:
+        return
+    for nome in faltantes:
+        db.session.add(CacheVersao(nome=nome, versao=0))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # outro worker criou ao mesmo tempo
+        db.session.rollback()
+
+
+def ensure_schema() -> None:
+    _ensure_columns(
+        Pedido,
+        ("fornecedor_busca", "arquivo_fingerprint", "total_valor", "item_count", "versao", "updated_at"),
+    )
+    _ensure_columns(User, ("username_norm",))
+    _ensure_columns(Fornecedor, ("nome_norm",))
+    _migrate_lc_fingerprints()
+    _drop_obsolete_indexes()
+    for model in (Pedido, User, Fornecedor, Job, PedidoRemovido, Evento):
+        _ensure_indexes(model)
+    if _is_postgres():
+        _ensure_trigram_index()
+    _backfill_normalized(Pedido, "fornecedor", "fornecedor_busca")
+    _backfill_normalized(User, "username", "username_norm")
+    _backfill_normalized(Fornecedor, "nome", "nome_norm")
+    _backfill_order_totals()
+    _backfill_updated_at()
+    _ensure_cache_versions()
 
 
-def _initialize_app():
-    global PURGED_ON_START
+# =====================================================
+# INIT
+# =====================================================
+def initialize_database(purge: bool = True) -> dict:
+    """Cria/ajusta o esquema, garante usuarios iniciais e remove pedidos antigos.
+
+    Executado por `flask --app app pedidos init` (ou PEDIDOS_INIT_ON_START=1),
+    nunca na importacao: os workers sobem sem escrever no banco.
+    """
     with app.app_context():
         # cria as tabelas automaticamente no banco (Postgres) e garante usuarios
         db.create_all()
+        ensure_schema()
         garantir_usuarios_iniciais()
-        PURGED_ON_START = purge_old_pedidos()
+        removidos = purge_old_pedidos() if purge else 0
+    return {"purged": removidos}
+
+
+pedidos_cli = AppGroup("pedidos", help="Manutencao do banco de pedidos.")
+
+
+@pedidos_cli.command("init")
+@click.option("--no-purge", is_flag=True, help="Nao remove pedidos antigos.")
+def cli_init(no_purge):
+    """Cria tabelas/indices, garante usuarios iniciais e faz a limpeza."""
+    result = initialize_database(purge=not no_purge)
+    click.echo(f"Banco inicializado; {result['purged']} pedidos antigos removidos.")
+
+
+@pedidos_cli.command("purge")
+@click.option("--dias", default=RETENCAO_DIAS, show_default=True, help="Idade maxima dos pedidos.")
+@click.option("--lote", default=RETENCAO_LOTE, show_default=True, help="Pedidos por transacao.")
+@click.option("--arquivar/--sem-arquivar", default=RETENCAO_ARQUIVAR, help="Grava JSONL.gz antes de remover.")
+def cli_purge(dias, lote, arquivar):
+    """Remove pedidos mais antigos que --dias, com itens e planilhas."""
+    relatorio = run_retention(days=dias, batch_size=lote, archive=arquivar)
+    click.echo(
+        f"{relatorio['pedidos']} pedidos, {relatorio['itens']} itens e "
+        f"{relatorio['arquivos']} arquivos ({relatorio['bytes']} bytes) removidos."
+    )
+    if relatorio["arquivo_morto"]:
+        click.echo(f"Arquivo morto: {relatorio['arquivo_morto']}")
+
+
+app.cli.add_command(pedidos_cli)
 
 
-_initialize_app()
+def _resume_jobs_in_background() -> None:
+    if JOB_WORKERS <= 0:
+        return
+    # fora do caminho critico do boot: roda numa thread da propria fila
+    _get_job_executor().submit(_run_in_app_context, resume_pending_jobs)
+
+
+def create_app() -> Flask:
+    """Ponto de entrada WSGI (`gunicorn "app:create_app()"`)."""
+    if os.environ.get("PEDIDOS_INIT_ON_START", "").strip().lower() in {"1", "true", "yes", "on"}:
+        initialize_database()
+    _resume_jobs_in_background()
+    start_retention_scheduler()
+    return app
 
 
 if __name__ == "__main__":
+    initialize_database()
+    create_app()
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_DEBUG", "").lower() in {"1", "true", "yes"}
     app.run(host="0.0.0.0", port=port, debug=debug)
-
+
\ No newline at end of file
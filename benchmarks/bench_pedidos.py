@@ -0,0 +1,296 @@
+"""Benchmark dos caminhos principais de pedidos, com resultado em JSON.
+
+Cria um banco temporario (SQLite por padrao; `--database-url` aponta para um
+PostgreSQL local *descartavel*), popula fornecedores, pedidos e itens nos
+volumes pedidos e mede:
+
+- list_orders (completa, filtrada e primeira pagina do cursor)
+- get_order
+- create_pending_order / update_pending_order
+- generate_order_file sobre o modelo_pedido.xlsm (sem e com reaproveitamento)
+- generate_automatic_orders_from_workbook sobre uma planilha LC sintetica
+
+Uso:
+    python benchmarks/bench_pedidos.py [--pedidos 2000] [--itens 10] [--saida resultado.json]
+
+Para comparar commits, rode com os mesmos parametros e compare os JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+STATUS_SEMEADOS = ("Pendente", "Pendente", "Aprovado", "Gerado")
+
+
+def _preparar_ambiente(storage: str, database_url: str | None) -> None:
+    # precisa acontecer antes do import do app (configuracao lida no import)
+    os.environ["PEDIDOS_STORAGE_DIR"] = storage
+    os.environ["PEDIDOS_DB_PATH"] = str(Path(storage) / "bench.db")
+    os.environ["PEDIDOS_LC_PATH"] = str(Path(storage) / "LC.xlsx")
+    os.environ.setdefault("PEDIDOS_MODELO_PATH", str(ROOT / "modelo_pedido.xlsm"))
+    os.environ["PEDIDOS_JOB_WORKERS"] = "0"
+    os.environ["PEDIDOS_RETENCAO_INTERVALO_HORAS"] = "0"
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+        os.environ.pop("PEDIDOS_FORCE_SQLITE", None)
+    else:
+        os.environ["PEDIDOS_FORCE_SQLITE"] = "1"
+    sys.path.insert(0, str(ROOT))
+
+
+def _commit_atual() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=str(ROOT),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _resumo(tempos: list[float]) -> dict:
+    ordenados = sorted(tempos)
+    return {
+        "n": len(tempos),
+        "media_ms": round(statistics.mean(tempos) * 1000, 3),
+        "p50_ms": round(ordenados[len(ordenados) // 2] * 1000, 3),
+        "p95_ms": round(ordenados[max(int(len(ordenados) * 0.95) - 1, 0)] * 1000, 3),
+        "min_ms": round(ordenados[0] * 1000, 3),
+        "max_ms": round(ordenados[-1] * 1000, 3),
+    }
+
+
+def _medir(pedidos_app, func, repeticoes: int, preparar=None) -> dict:
+    """Executa `func(preparar())` `repeticoes` vezes; so a chamada entra no tempo."""
+    tempos = []
+    for _ in range(repeticoes):
+        argumento = preparar() if preparar else None
+        inicio = time.perf_counter()
+        func(argumento)
+        tempos.append(time.perf_counter() - inicio)
+        # sessao nova a cada chamada: sem reaproveitar o identity map
+        pedidos_app.db.session.remove()
+    return _resumo(tempos)
+
+
+def _itens(rng: random.Random, quantidade: int) -> list[dict]:
+    return [
+        {
+            "quantidade": rng.randint(1, 50),
+            "prefixo": "PX",
+            "codigo": f"COD-{rng.randint(1, 99999):05d}",
+            "descricao": f"Item de benchmark {idx}",
+            "valor": round(rng.uniform(1, 500), 2),
+            "estoque": rng.randint(0, 100),
+        }
+        for idx in range(1, quantidade + 1)
+    ]
+
+
+def _popular(pedidos_app, rng: random.Random, fornecedores: int, pedidos: int, itens: int) -> list[str]:
+    from sqlalchemy import insert
+
+    db = pedidos_app.db
+    nomes = [f"Fornecedor {idx:03d}" for idx in range(1, fornecedores + 1)]
+    db.session.execute(
+        insert(pedidos_app.Fornecedor),
+        [{"nome": nome, "nome_norm": pedidos_app.normalize_search_text(nome)} for nome in nomes],
+    )
+    agora = datetime.utcnow()
+    lote = 1000
+    for inicio in range(0, pedidos, lote):
+        linhas = []
+        itens_lote = []
+        for _ in range(min(lote, pedidos - inicio)):
+            nome = rng.choice(nomes)
+            criado = agora - timedelta(days=rng.uniform(0, 120))
+            itens_pedido = _itens(rng, itens)
+            total, contagem = pedidos_app.order_totals(itens_pedido)
+            linhas.append(
+                {
+                    "fornecedor": nome,
+                    "fornecedor_busca": pedidos_app.normalize_search_text(nome),
+                    "arquivo_excel": "",
+                    "arquivo_pdf": "",
+                    "status": rng.choice(STATUS_SEMEADOS),
+                    "created_by": rng.choice(("MIGUEL", "MICHEL", "LUCAS")),
+                    "created_at": criado,
+                    "updated_at": criado,
+                    "total_valor": total,
+                    "item_count": contagem,
+                    "versao": 0,
+                }
+            )
+            itens_lote.append(itens_pedido)
+        ids = db.session.scalars(
+            insert(pedidos_app.Pedido).returning(pedidos_app.Pedido.id, sort_by_parameter_order=True),
+            linhas,
+        ).all()
+        db.session.execute(
+            insert(pedidos_app.PedidoItem),
+            [
+                {
+                    "pedido_id": pedido_id,
+                    "codigo": item["codigo"],
+                    "descricao": item["descricao"],
+                    "quantidade": item["quantidade"],
+                    "prefixo": item["prefixo"],
+                    "valor": Decimal(str(item["valor"])),
+                    "estoque": item["estoque"],
+                }
+                for pedido_id, itens_pedido in zip(ids, itens_lote)
+                for item in itens_pedido
+            ],
+        )
+        db.session.commit()
+    return nomes
+
+
+def _planilha_lc(caminho: Path, linhas: int, rng: random.Random) -> None:
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["", "", "QNT COMPRA"] + [""] * 5 + [f"COL{idx}" for idx in range(9, 22)])
+    for idx in range(linhas):
+        # coluna C: quantidade; colunas I-U: descricao
+        valores = [f"LC{idx}-{col}" for col in range(rng.randint(1, 6))]
+        ws.append([None, None, rng.randint(1, 40), None, None, None, None, None] + valores)
+    wb.save(caminho)
+
+
+def _alterar_planilha_lc(caminho: Path, fracao: float, rng: random.Random) -> None:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(caminho)
+    ws = wb.active
+    for row in rng.sample(range(2, ws.max_row + 1), max(1, int((ws.max_row - 1) * fracao))):
+        ws.cell(row=row, column=3).value = rng.randint(41, 80)
+    wb.save(caminho)
+
+
+def _resetar_importacao_lc(pedidos_app) -> None:
+    db = pedidos_app.db
+    db.session.query(pedidos_app.ImportacaoLCLinha).delete()
+    db.session.query(pedidos_app.ImportacaoLC).delete()
+    db.session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fornecedores", type=int, default=20)
+    parser.add_argument("--pedidos", type=int, default=2000, help="pedidos semeados")
+    parser.add_argument("--itens", type=int, default=10, help="itens por pedido")
+    parser.add_argument("--linhas-lc", type=int, default=2000, help="linhas da planilha LC sintetica")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="PostgreSQL descartavel (as tabelas sao criadas e populadas)")
+    parser.add_argument("--saida", help="grava o JSON neste arquivo (padrao: stdout)")
+    args = parser.parse_args()
+
+    storage = tempfile.mkdtemp(prefix="pedidos_bench_")
+    _preparar_ambiente(storage, args.database_url)
+    import app as pedidos_app
+
+    rng = random.Random(args.seed)
+    repeticoes = args.repeticoes
+    pedidos_app.initialize_database(purge=False)
+    resultados: dict[str, dict] = {}
+
+    with pedidos_app.app.app_context():
+        inicio = time.perf_counter()
+        nomes = _popular(pedidos_app, rng, args.fornecedores, args.pedidos, args.itens)
+        semeadura = time.perf_counter() - inicio
+        ids = [row[0] for row in pedidos_app.db.session.query(pedidos_app.Pedido.id).all()]
+
+        resultados["list_orders"] = _medir(pedidos_app, lambda _: pedidos_app.list_orders(), repeticoes)
+        resultados["list_orders_fornecedor"] = _medir(
+            pedidos_app, lambda nome: pedidos_app.list_orders(fornecedor=nome), repeticoes, lambda: rng.choice(nomes)
+        )
+        resultados["list_orders_page"] = _medir(
+            pedidos_app, lambda _: pedidos_app.list_orders_page(limit=50), repeticoes
+        )
+        resultados["get_order"] = _medir(pedidos_app, pedidos_app.get_order, repeticoes, lambda: rng.choice(ids))
+
+        criados: list[int] = []
+        resultados["create_pending_order"] = _medir(
+            pedidos_app,
+            lambda itens: criados.append(pedidos_app.create_pending_order(rng.choice(nomes), itens, "MIGUEL")),
+            repeticoes,
+            lambda: _itens(rng, args.itens),
+        )
+
+        def _edicao():
+            pedido = pedidos_app.get_order(rng.choice(criados))
+            itens = [dict(item) for item in pedido["itens"]]
+            itens[0]["quantidade"] += 1
+            return pedido["id"], itens
+
+        resultados["update_pending_order"] = _medir(
+            pedidos_app, lambda dados: pedidos_app.update_pending_order(*dados), repeticoes, _edicao
+        )
+
+        if pedidos_app.MODELO_PATH.exists():
+            for pedido_id in criados:
+                pedidos_app.approve_order(pedido_id, "MICHEL")
+            fila = list(criados)
+            resultados["generate_order_file"] = _medir(
+                pedidos_app, pedidos_app.generate_order_file, len(fila), fila.pop
+            )
+            resultados["generate_order_file_reaproveitado"] = _medir(
+                pedidos_app, pedidos_app.generate_order_file, repeticoes, lambda: rng.choice(criados)
+            )
+
+        caminho_lc = Path(os.environ["PEDIDOS_LC_PATH"])
+        _planilha_lc(caminho_lc, args.linhas_lc, rng)
+
+        def importar(_):
+            return pedidos_app.generate_automatic_orders_from_workbook("LUCAS")
+
+        resultados["lc_importacao_completa"] = _medir(
+            pedidos_app, importar, min(repeticoes, 3), lambda: _resetar_importacao_lc(pedidos_app)
+        )
+        resultados["lc_importacao_sem_alteracao"] = _medir(pedidos_app, importar, repeticoes)
+        resultados["lc_importacao_incremental"] = _medir(
+            pedidos_app, importar, min(repeticoes, 3), lambda: _alterar_planilha_lc(caminho_lc, 0.01, rng)
+        )
+
+    relatorio = {
+        "commit": _commit_atual(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "banco": "postgresql" if args.database_url else "sqlite",
+        "volumes": {
+            "fornecedores": args.fornecedores,
+            "pedidos": args.pedidos,
+            "itens_por_pedido": args.itens,
+            "linhas_lc": args.linhas_lc,
+            "repeticoes": repeticoes,
+            "seed": args.seed,
+        },
+        "semeadura_s": round(semeadura, 3),
+        "resultados": resultados,
+    }
+    saida = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        Path(args.saida).write_text(saida + "\n", encoding="utf-8")
+    else:
+        print(saida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compara os motores de geracao de planilha (openpyxl x xml) sobre o modelo_pedido.xlsm.
+
+Uso: python benchmarks/bench_planilha.py [--pedidos 50] [--itens 18]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _preparar_ambiente() -> None:
+    # banco e pastas temporarios: o benchmark nao toca nos dados reais
+    storage = tempfile.mkdtemp(prefix="pedidos_bench_")
+    os.environ["PEDIDOS_FORCE_SQLITE"] = "1"
+    os.environ["PEDIDOS_STORAGE_DIR"] = storage
+    os.environ["PEDIDOS_DB_PATH"] = str(Path(storage) / "bench.db")
+    os.environ.setdefault("PEDIDOS_MODELO_PATH", str(ROOT / "modelo_pedido.xlsm"))
+    sys.path.insert(0, str(ROOT))
+
+
+def _payload(numero: int, itens: int) -> dict:
+    return {
+        "numero": numero,
+        "fornecedor": "Fornecedor Benchmark",
+        "data": datetime(2025, 1, 15),
+        "itens": [
+            {
+                "quantidade": idx,
+                "prefixo": "PX",
+                "codigo": f"COD-{idx:04d}",
+                "descricao": f"Item de teste {idx}",
+                "valor_unitario": 10.5 * idx,
+            }
+            for idx in range(1, itens + 1)
+        ],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pedidos", type=int, default=50, help="pedidos gerados por motor")
+    parser.add_argument("--itens", type=int, default=18, help="itens por pedido")
+    args = parser.parse_args()
+
+    _preparar_ambiente()
+    import app as pedidos_app
+
+    for engine in ("openpyxl", "xml"):
+        pedidos_app.PLANILHA_ENGINE = engine
+        # primeira chamada aquece o cache do modelo e fica fora da medicao
+        primeira = time.perf_counter()
+        pedidos_app.gerar_arquivo_pedido_aprovado_arquivo(_payload(0, args.itens))
+        primeira = time.perf_counter() - primeira
+
+        tempos = []
+        for numero in range(1, args.pedidos + 1):
+            inicio = time.perf_counter()
+            caminho = pedidos_app.gerar_arquivo_pedido_aprovado_arquivo(_payload(numero, args.itens))
+            tempos.append(time.perf_counter() - inicio)
+        tamanho = Path(caminho).stat().st_size
+        print(
+            f"{engine:>8}: primeira={primeira * 1000:7.1f}ms "
+            f"media={statistics.mean(tempos) * 1000:7.2f}ms "
+            f"p95={sorted(tempos)[int(len(tempos) * 0.95) - 1] * 1000:7.2f}ms "
+            f"arquivo={tamanho / 1024:.1f}KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
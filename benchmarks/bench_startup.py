@@ -0,0 +1,76 @@
+"""Mede o tempo de boot de um worker (import do app + create_app) em processo novo.
+
+Compara o boot padrao (sem escrita no banco) com PEDIDOS_INIT_ON_START=1,
+que repete o comportamento antigo (create_all, usuarios iniciais e limpeza).
+
+Uso: python benchmarks/bench_startup.py [--repeticoes 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_BOOT_SCRIPT = """
+import time
+inicio = time.perf_counter()
+import app
+app.create_app()
+print(time.perf_counter() - inicio)
+"""
+
+
+def _ambiente(storage: str, init_on_start: bool) -> dict:
+    env = dict(os.environ)
+    env.update(
+        PEDIDOS_FORCE_SQLITE="1",
+        PEDIDOS_STORAGE_DIR=storage,
+        PEDIDOS_DB_PATH=str(Path(storage) / "bench.db"),
+        PEDIDOS_INIT_ON_START="1" if init_on_start else "0",
+        PEDIDOS_JOB_WORKERS="0",
+    )
+    return env
+
+
+def _boot(env: dict) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", _BOOT_SCRIPT],
+        cwd=str(ROOT),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    storage = tempfile.mkdtemp(prefix="pedidos_boot_")
+    # banco ja inicializado, como num restart/scale-out em producao
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "app", "pedidos", "init"],
+        cwd=str(ROOT),
+        env=_ambiente(storage, False),
+        capture_output=True,
+        check=True,
+    )
+
+    for rotulo, init_on_start in (("sem init", False), ("com init", True)):
+        env = _ambiente(storage, init_on_start)
+        tempos = [_boot(env) for _ in range(args.repeticoes)]
+        print(
+            f"{rotulo}: media={statistics.mean(tempos) * 1000:7.1f}ms "
+            f"min={min(tempos) * 1000:7.1f}ms max={max(tempos) * 1000:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Teste de carga local: criadores e aprovadores simultaneos contra o app.
+
+Sobe o app (gunicorn, ou o servidor do Flask com `--servidor flask`) sobre um
+SQLite temporario, inicializado com `flask --app app pedidos init`, e simula
+usuarios logados como MIGUEL (criador), MICHEL (aprovador) e LUCAS (admin)
+numa mistura de:
+
+- POST /api/pedidos            (criadores)
+- GET  /api/pedidos            (todos)
+- POST /api/pedidos/<id>/approve (aprovadores)
+- GET  /pedidos/<id>/download  (aprovadores/admin, pedidos ja gerados)
+
+Ao final imprime, por endpoint, requisicoes, erros, vazao e latencia
+p50/p95/p99. Roda sem rede externa. Com `--url`, usa um servidor ja em
+execucao, que precisa ter os usuarios acima com a senha de `--senha`
+(padrao: a senha inicial). Um login recusado interrompe o teste antes da carga.
+
+Uso:
+    python benchmarks/carga.py [--usuarios 12] [--duracao 30] [--workers 2] [--threads 8]
+"""
+import argparse
+import http.cookiejar
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SENHA_PADRAO = "1234"
+FORNECEDOR = "Fornecedor Carga"
+
+# papel -> (usuario, acoes com peso)
+PERFIS = {
+    "criador": ("MIGUEL", (("criar", 4), ("listar", 5), ("detalhe", 1))),
+    "aprovador": ("MICHEL", (("listar", 4), ("aprovar", 3), ("baixar", 2), ("detalhe", 1))),
+    "admin": ("LUCAS", (("listar", 6), ("baixar", 2), ("detalhe", 2))),
+}
+MISTURA_USUARIOS = ("criador", "criador", "aprovador", "admin")
+
+
+class Estatisticas:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencias: dict[str, list[float]] = {}
+        self.erros: dict[str, dict[int, int]] = {}
+
+    def registrar(self, rotulo: str, status: int, duracao: float) -> None:
+        with self._lock:
+            self.latencias.setdefault(rotulo, []).append(duracao)
+            if status >= 400 or status == 0:
+                por_status = self.erros.setdefault(rotulo, {})
+                por_status[status] = por_status.get(status, 0) + 1
+
+
+class Cliente:
+    """Sessao HTTP com cookies (login do Flask) e medicao por endpoint."""
+
+    def __init__(self, base_url: str, estatisticas: Estatisticas) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.estatisticas = estatisticas
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def requisitar(self, rotulo: str | None, metodo: str, caminho: str, dados=None, formulario=None):
+        corpo = None
+        cabecalhos = {}
+        if dados is not None:
+            corpo = json.dumps(dados).encode("utf-8")
+            cabecalhos["Content-Type"] = "application/json"
+        elif formulario is not None:
+            corpo = urllib.parse.urlencode(formulario).encode("utf-8")
+            cabecalhos["Content-Type"] = "application/x-www-form-urlencoded"
+        pedido = urllib.request.Request(self.base_url + caminho, data=corpo, headers=cabecalhos, method=metodo)
+        inicio = time.perf_counter()
+        status, conteudo = 0, b""
+        try:
+            with self.opener.open(pedido, timeout=60) as resposta:
+                status, conteudo = resposta.status, resposta.read()
+        except urllib.error.HTTPError as exc:
+            status, conteudo = exc.code, exc.read()
+        except (urllib.error.URLError, OSError):
+            status = 0
+        if rotulo:
+            self.estatisticas.registrar(rotulo, status, time.perf_counter() - inicio)
+        return status, conteudo
+
+    def json(self, rotulo, metodo, caminho, dados=None):
+        status, conteudo = self.requisitar(rotulo, metodo, caminho, dados=dados)
+        try:
+            return status, json.loads(conteudo or b"{}")
+        except ValueError:
+            return status, {}
+
+    def login(self, usuario: str, senha: str = SENHA_PADRAO) -> None:
+        status, _ = self.requisitar(None, "POST", "/login", formulario={"username": usuario, "password": senha})
+        # login recusado devolve a pagina de login com HTTP 200: confirma pela sessao
+        if status == 200:
+            status, _ = self.requisitar(None, "GET", "/api/context")
+        if status != 200:
+            raise RuntimeError(f"Falha no login de {usuario} (HTTP {status}); confira --senha")
+
+
+def _usuario_virtual(base_url, perfil, senha, estatisticas, fim, pausa, semente) -> None:
+    rng = random.Random(semente)
+    usuario, acoes = PERFIS[perfil]
+    cliente = Cliente(base_url, estatisticas)
+    cliente.login(usuario, senha)
+    nomes, pesos = zip(*acoes)
+    pedidos: list[dict] = []
+    while time.monotonic() < fim:
+        acao = rng.choices(nomes, weights=pesos)[0]
+        if acao == "criar":
+            itens = [
+                {
+                    "quantidade": rng.randint(1, 20),
+                    "codigo": f"CG-{rng.randint(1, 9999):04d}",
+                    "descricao": "Item do teste de carga",
+                    "prefixo": "CG",
+                    "valor": round(rng.uniform(1, 300), 2),
+                }
+                for _ in range(rng.randint(1, 15))
+            ]
+            cliente.json("POST /api/pedidos", "POST", "/api/pedidos", {"fornecedor": FORNECEDOR, "itens": itens})
+        elif acao == "listar" or not pedidos:
+            status, dados = cliente.json("GET /api/pedidos", "GET", "/api/pedidos")
+            if status == 200:
+                pedidos = dados.get("pedidos") or []
+        elif acao == "detalhe":
+            pedido = rng.choice(pedidos)
+            cliente.json("GET /api/pedidos/<id>", "GET", f"/api/pedidos/{pedido['id']}")
+        elif acao == "aprovar":
+            pendentes = [pedido for pedido in pedidos if pedido["status"] == "Pendente"]
+            if pendentes:
+                pedido = rng.choice(pendentes)
+                cliente.json("POST /api/pedidos/<id>/approve", "POST", f"/api/pedidos/{pedido['id']}/approve")
+                # nao aprova o mesmo pedido duas vezes ate a proxima listagem
+                pedido["status"] = "Aprovado"
+        elif acao == "baixar":
+            gerados = [pedido for pedido in pedidos if pedido.get("arquivo_excel")]
+            if gerados:
+                pedido = rng.choice(gerados)
+                cliente.requisitar("GET /pedidos/<id>/download", "GET", f"/pedidos/{pedido['id']}/download")
+        if pausa:
+            time.sleep(rng.uniform(0, pausa * 2))
+
+
+def _porta_livre() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _subir_servidor(args) -> tuple[subprocess.Popen, str, str]:
+    storage = tempfile.mkdtemp(prefix="pedidos_carga_")
+    env = dict(os.environ)
+    env.update(
+        PEDIDOS_FORCE_SQLITE="1",
+        PEDIDOS_STORAGE_DIR=storage,
+        PEDIDOS_DB_PATH=str(Path(storage) / "carga.db"),
+        PEDIDOS_RETENCAO_INTERVALO_HORAS="0",
+    )
+    env.setdefault("PEDIDOS_MODELO_PATH", str(ROOT / "modelo_pedido.xlsm"))
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "app", "pedidos", "init", "--no-purge"],
+        cwd=str(ROOT),
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+    porta = _porta_livre()
+    if args.servidor == "gunicorn" and importlib.util.find_spec("gunicorn") is None:
+        # gunicorn nao roda no Windows; o servidor do Flask serve para comparacoes locais
+        print("gunicorn indisponivel; usando o servidor do Flask", file=sys.stderr)
+        args.servidor = "flask"
+    if args.servidor == "gunicorn":
+        comando = [
+            sys.executable, "-m", "gunicorn",
+            "--bind", f"127.0.0.1:{porta}",
+            "--workers", str(args.workers),
+            "--threads", str(args.threads),
+            "--log-level", "warning",
+            "app:create_app()",
+        ]
+    else:
+        comando = [
+            sys.executable, "-m", "flask", "--app", "app:create_app()",
+            "run", "--port", str(porta), "--with-threads",
+        ]
+    processo = subprocess.Popen(
+        comando, cwd=str(ROOT), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{porta}"
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            urllib.request.urlopen(base_url + "/health", timeout=2).read()
+            return processo, base_url, storage
+        except OSError:
+            if processo.poll() is not None:
+                raise RuntimeError("Servidor encerrou durante a inicializacao")
+            time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError("Servidor nao respondeu em 30s")
+
+
+def _percentil(ordenados: list[float], fracao: float) -> float:
+    indice = min(len(ordenados) - 1, max(0, int(round(fracao * len(ordenados))) - 1))
+    return ordenados[indice]
+
+
+def _relatorio(estatisticas: Estatisticas, duracao: float) -> dict:
+    resultado = {}
+    for rotulo, tempos in sorted(estatisticas.latencias.items()):
+        ordenados = sorted(tempos)
+        resultado[rotulo] = {
+            "requisicoes": len(tempos),
+            "erros": sum(estatisticas.erros.get(rotulo, {}).values()),
+            "erros_por_status": estatisticas.erros.get(rotulo, {}),
+            "req_s": round(len(tempos) / duracao, 2),
+            "p50_ms": round(_percentil(ordenados, 0.50) * 1000, 1),
+            "p95_ms": round(_percentil(ordenados, 0.95) * 1000, 1),
+            "p99_ms": round(_percentil(ordenados, 0.99) * 1000, 1),
+        }
+    return resultado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=12, help="usuarios virtuais simultaneos")
+    parser.add_argument("--duracao", type=float, default=30, help="segundos de carga")
+    parser.add_argument("--pausa", type=float, default=0.0, help="pausa media entre acoes (s)")
+    parser.add_argument("--servidor", choices=("gunicorn", "flask"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="workers do gunicorn")
+    parser.add_argument("--threads", type=int, default=8, help="threads por worker do gunicorn")
+    parser.add_argument("--url", help="servidor ja em execucao (nao sobe um local)")
+    parser.add_argument("--senha", default=SENHA_PADRAO, help="senha dos usuarios MIGUEL/MICHEL/LUCAS")
+    parser.add_argument("--pedidos-iniciais", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    processo = None
+    if args.url:
+        base_url = args.url
+    else:
+        processo, base_url, storage = _subir_servidor(args)
+        print(f"Servidor local em {base_url} (dados em {storage})", file=sys.stderr)
+
+    try:
+        estatisticas = Estatisticas()
+        # todos os usuarios do teste precisam entrar antes da carga comecar
+        for perfil in sorted(set(MISTURA_USUARIOS)):
+            Cliente(base_url, Estatisticas()).login(PERFIS[perfil][0], args.senha)
+        preparo = Cliente(base_url, Estatisticas())
+        preparo.login("LUCAS", args.senha)
+        preparo.json(None, "POST", "/api/fornecedores", {"nome": FORNECEDOR})
+        for _ in range(args.pedidos_iniciais):
+            preparo.json(
+                None,
+                "POST",
+                "/api/pedidos",
+                {"fornecedor": FORNECEDOR, "itens": [{"quantidade": 1, "codigo": "INI", "descricao": "Inicial", "valor": 10}]},
+            )
+
+        inicio = time.monotonic()
+        fim = inicio + args.duracao
+        threads = [
+            threading.Thread(
+                target=_usuario_virtual,
+                args=(
+                    base_url,
+                    MISTURA_USUARIOS[idx % len(MISTURA_USUARIOS)],
+                    args.senha,
+                    estatisticas,
+                    fim,
+                    args.pausa,
+                    args.seed + idx,
+                ),
+                daemon=True,
+            )
+            for idx in range(args.usuarios)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.monotonic() - inicio
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait(timeout=10)
+
+    relatorio = _relatorio(estatisticas, duracao)
+    total = sum(linha["requisicoes"] for linha in relatorio.values())
+    if args.json:
+        print(json.dumps({"usuarios": args.usuarios, "duracao_s": round(duracao, 1), "req_s": round(total / duracao, 2), "endpoints": relatorio}, indent=2))
+        return
+    print(f"{args.usuarios} usuarios, {duracao:.1f}s, {total} requisicoes ({total / duracao:.1f} req/s)")
+    print(f"{'endpoint':<34}{'req':>7}{'erros':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for rotulo, linha in relatorio.items():
+        print(
+            f"{rotulo:<34}{linha['requisicoes']:>7}{linha['erros']:>7}{linha['req_s']:>8}"
+            f"{linha['p50_ms']:>8.1f}ms{linha['p95_ms']:>7.1f}ms{linha['p99_ms']:>7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
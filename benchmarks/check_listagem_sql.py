@@ -0,0 +1,107 @@
+"""Verifica quantos comandos SQL a listagem de pedidos emite.
+
+A listagem serializa apenas colunas de `pedidos`; os itens nao podem voltar a
+ser carregados junto (lazy="selectin" emitia um segundo SELECT com os itens de
+todos os pedidos). Cria um banco SQLite temporario com pedidos e itens, conta
+os comandos via `before_cursor_execute` e falha se `list_orders()` ou
+`list_orders_page()` emitirem mais de um. Tambem confere, pelo EXPLAIN QUERY
+PLAN, que a pagina (com e sem cursor) le o indice ix_pedidos_created_at_id
+sem ordenar numa B-tree temporaria, ou seja, que o custo independe do tamanho
+da tabela.
+
+Uso: python benchmarks/check_listagem_sql.py [--pedidos 20] [--itens 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _preparar_ambiente() -> None:
+    storage = tempfile.mkdtemp(prefix="pedidos_check_")
+    os.environ["PEDIDOS_FORCE_SQLITE"] = "1"
+    os.environ["PEDIDOS_STORAGE_DIR"] = storage
+    os.environ["PEDIDOS_DB_PATH"] = str(Path(storage) / "check.db")
+    os.environ["PEDIDOS_JOB_WORKERS"] = "0"
+    os.environ["PEDIDOS_RETENCAO_INTERVALO_HORAS"] = "0"
+    sys.path.insert(0, str(ROOT))
+
+
+INDICE_LISTAGEM = "ix_pedidos_created_at_id"
+
+
+def _contar_comandos(pedidos_app, func) -> list[tuple]:
+    from sqlalchemy import event
+
+    comandos: list[tuple] = []
+
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        comandos.append((statement, parameters))
+
+    engine = pedidos_app.db.engine
+    event.listen(engine, "before_cursor_execute", _antes)
+    try:
+        func()
+    finally:
+        event.remove(engine, "before_cursor_execute", _antes)
+        pedidos_app.db.session.remove()
+    return comandos
+
+
+def _plano(pedidos_app, statement: str, parameters) -> list[str]:
+    with pedidos_app.db.engine.connect() as conn:
+        cursor = conn.connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pedidos", type=int, default=20)
+    parser.add_argument("--itens", type=int, default=5, help="itens por pedido")
+    args = parser.parse_args()
+
+    _preparar_ambiente()
+    import app as pedidos_app
+
+    pedidos_app.initialize_database(purge=False)
+    itens = [
+        {"quantidade": idx, "prefixo": "PX", "codigo": f"COD-{idx:04d}", "descricao": f"Item {idx}", "valor": 1.5}
+        for idx in range(1, args.itens + 1)
+    ]
+    falhas = 0
+    with pedidos_app.app.app_context():
+        pedidos_app.add_supplier("Fornecedor Check")
+        for _ in range(args.pedidos):
+            pedidos_app.create_pending_order("Fornecedor Check", itens, "MIGUEL")
+        pedidos_app.db.session.remove()
+
+        cursor = pedidos_app.list_orders_page(limit=5)["next_cursor"]
+        pedidos_app.db.session.remove()
+        paginas = {"list_orders_page", "list_orders_page_cursor"}
+        for rotulo, func in (
+            ("list_orders", pedidos_app.list_orders),
+            ("list_orders_page", lambda: pedidos_app.list_orders_page(limit=10)),
+            ("list_orders_page_cursor", lambda: pedidos_app.list_orders_page(limit=10, cursor=cursor)),
+        ):
+            comandos = _contar_comandos(pedidos_app, func)
+            ok = len(comandos) == 1
+            falhas += not ok
+            print(f"{rotulo}: {len(comandos)} comando(s) SQL {'OK' if ok else 'FALHOU'}")
+            if not ok:
+                for statement, _ in comandos:
+                    print(f"  {' '.join(statement.split())[:160]}")
+            if rotulo in paginas and comandos:
+                plano = _plano(pedidos_app, *comandos[0])
+                texto = " | ".join(plano)
+                ok = INDICE_LISTAGEM in texto and "TEMP B-TREE" not in texto
+                falhas += not ok
+                print(f"{rotulo}: plano {'OK' if ok else 'FALHOU'} ({texto})")
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@
     statuses: [],
     items: [],
     orders: [],
+    // filtros e horario do servidor da ultima listagem (sincronizacao incremental)
+    ordersSync: { query: null, since: null },
     users: [],
     purgeInfo: null,
     modeloDisponivel: true,
@@ -154,7 +156,7 @@
       state.suppliers = data.suppliers || [];
       state.statuses = data.statuses || [];
       state.users = data.users || [];
-      state.purgeInfo = data.purged_on_start;
+      state.purgeInfo = data.ultima_retencao || null;
       state.modeloDisponivel = Boolean(data.modelo_disponivel);
       renderSuppliers();
       renderStatuses();
@@ -292,12 +294,14 @@
       return;
     }
     const info = [];
-    if (typeof state.purgeInfo === "number") {
-      if (state.purgeInfo > 0) {
-        info.push(
-          `${state.purgeInfo} pedidos antigos foram removidos automaticamente.`
-        );
-      }
+    // ultima retencao concluida (job em segundo plano, qualquer worker)
+    if (state.purgeInfo && state.purgeInfo.pedidos > 0) {
+      const quando = state.purgeInfo.em
+        ? ` em ${new Date(`${state.purgeInfo.em}Z`).toLocaleString("pt-BR")}`
+        : "";
+      info.push(
+        `${state.purgeInfo.pedidos} pedidos antigos foram removidos automaticamente${quando}.`
+      );
     }
     if (!state.modeloDisponivel) {
       info.push("Arquivo modelo_pedido.xlsm nao foi encontrado.");
@@ -333,6 +337,25 @@
     }
   }
 
+  function compareOrders(a, b) {
+    if (a.created_at !== b.created_at) {
+      return (b.created_at || "").localeCompare(a.created_at || "");
+    }
+    return b.id - a.id;
+  }
+
+  function mergeOrders(delta) {
+    const removidos = new Set(delta.removidos || []);
+    const byId = new Map();
+    state.orders.forEach((order) => {
+      if (!removidos.has(order.id)) {
+        byId.set(order.id, order);
+      }
+    });
+    (delta.pedidos || []).forEach((order) => byId.set(order.id, order));
+    state.orders = Array.from(byId.values()).sort(compareOrders);
+  }
+
   async function refreshOrders() {
     try {
       const params = new URLSearchParams();
@@ -343,10 +366,25 @@
         params.set("status", elements.filterStatus.value);
       }
       const query = params.toString();
-      const response = await apiFetch(
-        query ? `${urls.pedidos}?${query}` : urls.pedidos
-      );
-      state.orders = response.pedidos || [];
+      const sync = state.ordersSync;
+      if (sync.since && sync.query === query) {
+        // mesmos filtros: busca so o que mudou desde a ultima listagem
+        params.set("since", sync.since);
+        const delta = await apiFetch(`${urls.pedidos}?${params.toString()}`);
+        if (delta.reset) {
+          state.orders = delta.pedidos || [];
+        } else {
+          mergeOrders(delta);
+        }
+        state.ordersSync = { query, since: delta.server_time };
+      } else {
+        // troca de filtros: um `since` anterior ao horizonte devolve a
+        // listagem completa (reset) e o horario de partida para os deltas
+        params.set("since", "1970-01-01T00:00:00");
+        const response = await apiFetch(`${urls.pedidos}?${params.toString()}`);
+        state.orders = response.pedidos || [];
+        state.ordersSync = { query, since: response.server_time };
+      }
       renderOrdersTable();
     } catch (error) {
       showToast(error.message, "error");
@@ -575,6 +613,7 @@
         id,
         fornecedor: pedido.fornecedor,
         items: (pedido.itens || []).map((item) => ({
+          id: item.id,
           quantidade: item.quantidade,
           codigo: item.codigo,
           descricao: item.descricao,
@@ -722,7 +761,9 @@
     if (!state.editing) {
       return;
     }
+    // o id permite ao servidor atualizar so as linhas alteradas
     const items = state.editing.items.map((item) => ({
+      id: item.id,
       quantidade: item.quantidade,
       codigo: item.codigo,
       descricao: item.descricao,
@@ -747,15 +788,37 @@
     }
   }
 
+  async function waitForJob(jobUrl, { interval = 750, attempts = 40 } = {}) {
+    for (let attempt = 0; attempt < attempts; attempt += 1) {
+      const data = await apiFetch(jobUrl);
+      const job = data.job || {};
+      if (job.status === "concluido" || job.status === "erro") {
+        return job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, interval));
+    }
+    return null;
+  }
+
   async function approveOrder(id) {
     try {
       const result = await apiFetch(dynamicUrl.approve(id), { method: "POST" });
       if (result.warning) {
         showToast(result.warning, "error");
-      } else {
-        showToast("Pedido aprovado", "success");
+        await refreshOrders();
+        return;
       }
+      showToast("Pedido aprovado, gerando arquivo...", "success");
       await refreshOrders();
+      if (result.job_url) {
+        const job = await waitForJob(result.job_url);
+        if (job && job.status === "erro") {
+          showToast(`Pedido aprovado, mas houve erro ao gerar arquivo: ${job.erro}`, "error");
+        } else if (job) {
+          showToast("Arquivo do pedido gerado", "success");
+        }
+        await refreshOrders();
+      }
     } catch (error) {
       showToast(error.message, "error");
     }
@@ -982,11 +1045,56 @@
     setupDialogCloseButtons();
   }
 
+  // sem SSE (ex.: 503 por limite de conexoes no worker): consulta periodica
+  // incremental ate uma nova tentativa de conexao dar certo
+  const EVENTS_FALLBACK_POLL_MS = 30000;
+  const EVENTS_RETRY_MS = 120000;
+  let ordersPolling = null;
+
+  function listenOrderEvents() {
+    if (!window.EventSource || !urls.eventos) {
+      return;
+    }
+    // varios eventos em sequencia (ex.: importacao) viram uma unica sincronizacao
+    let timer = null;
+    const source = new EventSource(urls.eventos);
+    source.addEventListener("open", () => {
+      if (ordersPolling) {
+        clearInterval(ordersPolling);
+        ordersPolling = null;
+        refreshOrders();
+      }
+    });
+    source.addEventListener("error", () => {
+      // CONNECTING: reconexao automatica do navegador; CLOSED: servidor recusou
+      if (source.readyState !== EventSource.CLOSED) {
+        return;
+      }
+      if (!ordersPolling) {
+        ordersPolling = setInterval(refreshOrders, EVENTS_FALLBACK_POLL_MS);
+      }
+      setTimeout(listenOrderEvents, EVENTS_RETRY_MS);
+    });
+    [
+      "pedido_criado",
+      "pedido_atualizado",
+      "pedido_aprovado",
+      "pedido_gerado",
+      "pedido_removido",
+    ].forEach((tipo) => {
+      source.addEventListener(tipo, () => {
+        clearTimeout(timer);
+        timer = setTimeout(refreshOrders, 300);
+      });
+    });
+  }
+
   async function bootstrap() {
     renderItemsTable();
     initEventListeners();
     await loadContext();
     await refreshOrders();
+    listenOrderEvents();
   }
 
   bootstrap();
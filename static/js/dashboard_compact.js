@@ -1,4 +1,8 @@
 window.dashboardCompact = (function () {
+  // pedidos em tela e horario do servidor da ultima sincronizacao
+  let pedidosAtuais = [];
+  let pedidosSince = null;
+
   async function fetchCtx() {
     try {
       const response = await fetch("/api/context");
@@ -37,6 +41,26 @@ window.dashboardCompact = (function () {
     });
   }
 
+  function mergePedidos(delta) {
+    if (delta.reset) {
+      return delta.pedidos || [];
+    }
+    const removidos = new Set(delta.removidos || []);
+    const porId = new Map();
+    pedidosAtuais.forEach((pedido) => {
+      if (!removidos.has(pedido.id)) {
+        porId.set(pedido.id, pedido);
+      }
+    });
+    (delta.pedidos || []).forEach((pedido) => porId.set(pedido.id, pedido));
+    return Array.from(porId.values()).sort((a, b) => {
+      if (a.created_at !== b.created_at) {
+        return (b.created_at || "").localeCompare(a.created_at || "");
+      }
+      return b.id - a.id;
+    });
+  }
+
   function renderOrders(pedidos) {
     const container = document.getElementById("orders-table");
     if (!container) {
@@ -184,11 +208,23 @@ window.dashboardCompact = (function () {
       return;
     }
     renderSuppliers(ctx.suppliers || []);
+    await loadOrders();
+  }
 
+  async function loadOrders() {
     try {
-      const response = await fetch("/api/pedidos");
+      // sem `since` anterior, o epoch forca a listagem completa (reset)
+      const since = pedidosSince || "1970-01-01T00:00:00";
+      const response = await fetch(
+        `/api/pedidos?since=${encodeURIComponent(since)}`
+      );
       const data = await response.json();
-      renderOrders(data.pedidos || []);
+      if (!response.ok) {
+        throw new Error(data.error || "Falha ao carregar pedidos");
+      }
+      pedidosAtuais = mergePedidos(data);
+      pedidosSince = data.server_time;
+      renderOrders(pedidosAtuais);
     } catch (error) {
       console.error("Falha ao carregar pedidos", error);
       alert("Falha ao carregar pedidos.");
@@ -243,9 +279,54 @@ window.dashboardCompact = (function () {
     }
   }
 
+  // sem SSE (ex.: 503 por limite de conexoes no worker): consulta periodica
+  // incremental ate uma nova tentativa de conexao dar certo
+  const EVENTOS_POLL_MS = 30000;
+  const EVENTOS_RETRY_MS = 120000;
+  let pollingPedidos = null;
+
+  function listenEvents() {
+    if (!window.EventSource) {
+      return;
+    }
+    // varios eventos em sequencia (ex.: importacao) viram uma unica sincronizacao
+    let timer = null;
+    const source = new EventSource("/api/eventos");
+    source.addEventListener("open", () => {
+      if (pollingPedidos) {
+        clearInterval(pollingPedidos);
+        pollingPedidos = null;
+        loadOrders();
+      }
+    });
+    source.addEventListener("error", () => {
+      // CONNECTING: reconexao automatica do navegador; CLOSED: servidor recusou
+      if (source.readyState !== EventSource.CLOSED) {
+        return;
+      }
+      if (!pollingPedidos) {
+        pollingPedidos = setInterval(loadOrders, EVENTOS_POLL_MS);
+      }
+      setTimeout(listenEvents, EVENTOS_RETRY_MS);
+    });
+    [
+      "pedido_criado",
+      "pedido_atualizado",
+      "pedido_aprovado",
+      "pedido_gerado",
+      "pedido_removido",
+    ].forEach((tipo) => {
+      source.addEventListener(tipo, () => {
+        clearTimeout(timer);
+        timer = setTimeout(loadOrders, 300);
+      });
+    });
+  }
+
   async function init() {
     bind();
     await loadDashboard();
+    listenEvents();
   }
 
   return { init };
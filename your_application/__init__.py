@@ -2,11 +2,13 @@
 
 Render cria serviços Python com o comando padrão
 `gunicorn your_application.wsgi`. Este pacote expõe a aplicação Flask
-definida em `pedidos.py` sob o nome esperado (`application`) para manter
+definida em `app.py` sob o nome esperado (`application`) para manter
 compatibilidade com essa configuração.
 """
 
-from pedidos import app as application
+from app import create_app
+
+application = create_app()
 
 # Alias opcional para quem procurar `app`.
 app = application